@@ -0,0 +1,94 @@
+import sys
+from pathlib import Path
+from itertools import combinations
+
+# Add project root to Python path
+sys.path.append(str(Path(__file__).parent.parent))  # Makes helperfunctions discoverable
+
+from qiskit import QuantumCircuit, QuantumRegister
+
+from helperfunctions.randomcircuit import random_quantum_circuit_varied_percentages, get_qubits_of_circuit
+from helperfunctions.uncompfunctions import add_uncomputation, exhaustive_uncomputation, milp_uncomputation
+from helperfunctions.circuitgraphfunctions import get_computation_graph
+from helperfunctions.constants import StringConstants
+
+INPUT = StringConstants.INPUT.value
+ANCILLA = StringConstants.ANCILLA.value
+OUTPUT = StringConstants.OUTPUT.value
+
+EXHAUSTIVE_SEARCHES = ['pruned', 'gray', 'adding', 'conflict']
+
+# Ancillas controlling gates of other ancillas. ('aq2',) is cyclic by itself, but aq0
+# controls the gate on aq2 and its uncomp node breaks that cycle, so the largest
+# acyclic set ('aq0', 'aq1', 'aq2', 'aq4') is a superset of a cyclic set.
+def ancilla_controls_ancilla_circuit():
+    in_q = QuantumRegister(4, name='iq')
+    ot_q = QuantumRegister(4, name='oq')
+    an_q = QuantumRegister(5, name='aq')
+    circuit = QuantumCircuit(in_q, ot_q, an_q)
+
+    circuit.ccx(in_q[0], in_q[3], an_q[3])
+    circuit.mcx([an_q[1], an_q[3], an_q[2]], in_q[0])
+    circuit.ccx(an_q[0], an_q[3], an_q[2])
+    circuit.mcx([an_q[4], an_q[3], an_q[1], an_q[2]], an_q[0])
+
+    return circuit, 4, 5
+
+# Largest acyclic set, each set uncomputed from scratch in combinations order
+def brute_force_uncomputation(circuit_graph, ancillas):
+    for r in range(len(ancillas), 0, -1):
+        for ancilla_set in combinations(ancillas, r):
+            if not add_uncomputation(circuit_graph, list(ancilla_set))[1]:
+                return ancilla_set
+    return ()
+
+def evaluation_function(num_exp = 20, num_q = 5, num_a = 6, num_g = 25,
+                        percent_cc_gates = 0.3, percent_aa_gates = 0.4,
+                        percent_ca_gates = 0.15, percent_ac_gates = 0.15):
+    '''
+    Compare the exhaustive searches and MILP against brute force on the fixed circuit
+    and on num_exp random circuits with many ancilla-ancilla gates. Exhaustive searches
+    must return the same set, MILP and the conflict search with a MILP core search an 
+    acyclic set of the same size.
+    Returns the number of mismatches per search.
+    '''
+    circuits = [ancilla_controls_ancilla_circuit()]
+    for _ in range(num_exp):
+        _circuit, q, a, g = random_quantum_circuit_varied_percentages(
+            num_q=num_q, num_a=num_a, num_g=num_g, add_outputs=True, add_init=False,
+            percent_cc_gates=percent_cc_gates, percent_aa_gates=percent_aa_gates,
+            percent_ac_gates=percent_ac_gates, percent_ca_gates=percent_ca_gates)
+        circuits.append((_circuit, q, a))
+
+    mismatches = {search: 0 for search in EXHAUSTIVE_SEARCHES + ['milp', 'conflict_milp']}
+    for i, (_circuit, q, a) in enumerate(circuits):
+        ancillae_list = get_qubits_of_circuit(_circuit, a, ANCILLA)
+        outputs_list = get_qubits_of_circuit(_circuit, q, OUTPUT)
+        _computation_circuit_graph = get_computation_graph(_circuit, ancillae_list, outputs_list)
+
+        expected_set = brute_force_uncomputation(_computation_circuit_graph, ancillae_list)
+        for search in EXHAUSTIVE_SEARCHES:
+            _, ancilla_set = exhaustive_uncomputation(_computation_circuit_graph, ancillae_list,
+                                                      return_uncomputed_ancillas=True, search=search)
+            if tuple(ancilla_set) != tuple(expected_set):
+                print(f'Circuit {i}: {search} found {ancilla_set}, brute force found {expected_set}', file=sys.stderr)
+                mismatches[search] += 1
+
+        milp_sets = {'milp': milp_uncomputation(_computation_circuit_graph, ancillae_list, return_uncomputed_ancillas=True)[1], 
+                     'conflict_milp': exhaustive_uncomputation(_computation_circuit_graph, ancillae_list, return_uncomputed_ancillas=True, 
+                                                               search='conflict', core_search='milp')[1]}
+        for search, ancilla_set in milp_sets.items():
+            if len(ancilla_set) != len(expected_set) or add_uncomputation(_computation_circuit_graph, list(ancilla_set))[1]:
+                print(f'Circuit {i}: {search} found {ancilla_set}, brute force found {expected_set}', file=sys.stderr)
+                mismatches[search] += 1
+
+    return mismatches
+
+def main():
+    mismatches = evaluation_function()
+    print(f'Mismatches against brute force: {mismatches}', file=sys.stderr)
+    if any(mismatches.values()):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
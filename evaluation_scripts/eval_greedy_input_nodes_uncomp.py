@@ -5,11 +5,10 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).parent.parent))  # Makes helperfunctions discoverable
 
 import numpy as np
-from rustworkx import digraph_find_cycle
 
 from helperfunctions.randomcircuit import random_quantum_circuit_varied_percentages, get_qubits_of_circuit
 from helperfunctions.reversecircuitgraph import uncompute_input_nodes_greedy, uncomp_all_operations_using_bennetts_in_circuitgraph
-from helperfunctions.uncompfunctions import add_uncomputation
+from helperfunctions.uncompfunctions import add_uncomputation, ReachabilityIndex
 from helperfunctions.evaluation import plot_variable_results_better
 from helperfunctions.circuitgraphfunctions import get_computation_graph, get_uncomp_circuit
 from helperfunctions.constants import StringConstants
@@ -37,14 +36,15 @@ def evaluation_function(num_exp = 10, circ_decompose=3,
         outputs_list = get_qubits_of_circuit(_circuit, q, OUTPUT) 
 
         _computation_circuit_graph = get_computation_graph(_circuit, ancillae_list, outputs_list)
-        _ancillae_full_uncomp_circuit_graph, has_cycles = add_uncomputation(_computation_circuit_graph, 
-                                                           ancillae_list, allow_cycle=True)
-        
-        if not digraph_find_cycle(_ancillae_full_uncomp_circuit_graph):
+        # Skip acyclic circuits before building their uncomp graph
+        if not ReachabilityIndex(_computation_circuit_graph).would_cycle(ancillae_list):
             print(f'Iteration {i} uncomp was acyclic.')
             continue
         else:
             i += 1
+
+        _ancillae_full_uncomp_circuit_graph, has_cycles = add_uncomputation(_computation_circuit_graph, 
+                                                           ancillae_list, allow_cycle=True)
         
         _bennetts_uncomp_circuit_graph = uncomp_all_operations_using_bennetts_in_circuitgraph(_computation_circuit_graph)
         _greedy_input_uncomp_circuit_graph = uncompute_input_nodes_greedy(_ancillae_full_uncomp_circuit_graph)
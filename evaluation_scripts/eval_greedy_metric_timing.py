@@ -0,0 +1,57 @@
+import sys
+import time
+from pathlib import Path
+
+# Add project root to Python path
+sys.path.append(str(Path(__file__).parent.parent))  # Makes helperfunctions discoverable
+
+from helperfunctions.randomcircuit import random_quantum_circuit_varied_percentages, get_qubits_of_circuit
+from helperfunctions.uncompfunctions import add_uncomputation, get_greedy_scores
+from helperfunctions.circuitgraphfunctions import get_computation_graph
+from helperfunctions.constants import StringConstants
+
+ANCILLA = StringConstants.ANCILLA.value
+OUTPUT = StringConstants.OUTPUT.value
+
+METRICS = ['scc', 'walks']
+
+def evaluation_function(num_exp = 3, num_q = 10, num_a = 12, num_g = 2000,
+                        percent_cc_gates = 0.4, percent_aa_gates = 0.2,
+                        percent_ca_gates = 0.2, percent_ac_gates = 0.2):
+    '''
+    Time one round of greedy scores per metric on the full uncomp graph of num_exp
+    large random circuits. Returns the largest SCC and the seconds per metric for each.
+    '''
+    timings = []
+    for _ in range(num_exp):
+        _circuit, q, a, g = random_quantum_circuit_varied_percentages(
+            num_q=num_q, num_a=num_a, num_g=num_g, add_outputs=True, add_init=False,
+            percent_cc_gates=percent_cc_gates, percent_aa_gates=percent_aa_gates,
+            percent_ac_gates=percent_ac_gates, percent_ca_gates=percent_ca_gates)
+        ancillae_list = get_qubits_of_circuit(_circuit, a, ANCILLA)
+        outputs_list = get_qubits_of_circuit(_circuit, q, OUTPUT)
+        _computation_circuit_graph = get_computation_graph(_circuit, ancillae_list, outputs_list)
+        uncomp_circuit_graph, _ = add_uncomputation(_computation_circuit_graph, ancillae_list, allow_cycle=True)
+
+        sccs = uncomp_circuit_graph.strongly_connected_components()
+        seconds = {}
+        for metric in METRICS:
+            start_time = time.time()
+            get_greedy_scores(uncomp_circuit_graph, ancillae_list, metric=metric, sccs=sccs)
+            seconds[metric] = time.time() - start_time
+        timings.append((max(len(scc) for scc in sccs), seconds))
+
+    return timings
+
+def main(max_seconds = 2.0):
+    timings = evaluation_function()
+    slow = 0
+    for largest_scc, seconds in timings:
+        print(f'Largest SCC {largest_scc} nodes: ' + ', '.join(f'{m} {s:.3f}s' for m, s in seconds.items()), file=sys.stderr)
+        slow += seconds['walks'] > max_seconds
+    if slow:
+        print(f'Walk scores took over {max_seconds}s on {slow} circuits', file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
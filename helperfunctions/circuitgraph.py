@@ -0,0 +1,524 @@
+import copy
+from itertools import chain
+import rustworkx
+
+from .constants import StringConstants, EdgeType
+from .graphhelper import CGNode
+
+TARGET = StringConstants.TARGET.value
+CONTROL = StringConstants.CONTROL.value
+ANTIDEP = StringConstants.ANTIDEP.value
+
+# Edge payloads stay the string constants (graphviz drawing, notebooks and
+# rustworkx algorithms see them), the typed index works on the small ints.
+EDGE_TYPES = {
+    TARGET: EdgeType.TARGET,
+    CONTROL: EdgeType.CONTROL,
+    ANTIDEP: EdgeType.ANTIDEP,
+}
+
+
+class CircuitGraph(rustworkx.PyDiGraph):
+    '''
+    PyDiGraph for circuit graphs that also keeps, for every node, its incoming and outgoing
+    neighbours split by edge type (TARGET/CONTROL/ANTIDEP). Typed neighbour lookups cost
+    O(degree of that type) instead of filtering adj_direction() every time.
+
+    Nodes are also indexed by (label, node_num, node_type), so finding e.g. the uncomp node
+    of a given qubit and node_num is a dict lookup instead of a scan over nodes(), and by 
+    label, so wire_nodes() lists the nodes of one qubit. The node_num of a CGNode has to be 
+    set before it is added to the graph.
+
+    Cycle checks are incremental: while the graph is acyclic a topological order is kept
+    up to date with the Pearce-Kelly algorithm, so inserting an edge only reorders the nodes
+    between its endpoints, and the edge that closes a cycle is reported straight away.
+    find_cycle() only falls back to searching the whole graph when nodes or edges of a
+    known cycle were removed.
+
+    Mutations can be undone: after checkpoint(), node/edge insertions and removals and 
+    node flag changes made through set_node_flags() are journaled, and rollback() undoes 
+    them in reverse order at a cost proportional to the change. commit() keeps them.
+    Node indices are restored, the order in which neighbours are listed may differ.
+
+    The indices are kept up to date by the add/remove methods overridden below. Other in-place
+    rewrites of rustworkx (contract_nodes, merge_nodes, ...) are not tracked, call
+    rebuild_index() after using them.
+    '''
+
+    def __new__(cls, check_cycle=False, multigraph=False, attrs=None, **kwargs):
+        # Circuit graphs never have parallel edges, so default to multigraph=False
+        return super().__new__(cls, check_cycle, multigraph, attrs, **kwargs)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self._init_index()
+        self._topo_order = {}
+        self._init_journal()
+
+    def _init_journal(self):
+        # Undo entries of the open transactions, None when there is no transaction.
+        # _checkpoints holds the journal length at every open checkpoint.
+        self._journal = None
+        self._checkpoints = []
+
+    def _init_index(self):
+        # node -> (dict per edge type) of neighbour -> None. Dicts are used as ordered sets
+        # so that neighbours come back in the same order as adj_direction() would give them.
+        self._in_adj = {}
+        self._out_adj = {}
+        # (label, node_num, node_type) -> node index
+        self._node_keys = {}
+        # label -> node index -> None, the nodes on the wire of every qubit
+        self._wire_nodes = {}
+        # Cycle tracking. Acyclic: _topo_order maps node -> position and _cycle is None.
+        # Cyclic: _cycle is a list of edges of one cycle. Unknown: both are None.
+        self._topo_order = None
+        self._next_order = 0
+        self._cycle = None
+        self._closing_edge = None
+
+    def _add_to_index(self, node_index):
+        self._in_adj[node_index] = ({}, {}, {})
+        self._out_adj[node_index] = ({}, {}, {})
+        self._add_node_key(node_index)
+        if self._topo_order is not None:
+            self._topo_order[node_index] = self._next_order
+            self._next_order += 1
+
+    def _add_node_key(self, node_index):
+        node = self.get_node_data(node_index)
+        if isinstance(node, CGNode):
+            self._node_keys[(node.label, node.node_num, node.node_type)] = node_index
+            self._wire_nodes.setdefault(node.label, {})[node_index] = None
+
+    def _remove_node_key(self, node_index):
+        node = self.get_node_data(node_index)
+        if isinstance(node, CGNode):
+            key = (node.label, node.node_num, node.node_type)
+            if self._node_keys.get(key) == node_index:
+                del self._node_keys[key]
+            self._wire_nodes.get(node.label, {}).pop(node_index, None)
+
+    def _link(self, parent, child, edge):
+        edge_type = EDGE_TYPES.get(edge)
+        if edge_type is not None:
+            self._out_adj[parent][edge_type][child] = None
+            self._in_adj[child][edge_type][parent] = None
+
+    def _unlink(self, parent, child, edge):
+        edge_type = EDGE_TYPES.get(edge)
+        if edge_type is not None:
+            self._out_adj[parent][edge_type].pop(child, None)
+            self._in_adj[child][edge_type].pop(parent, None)
+
+    def rebuild_index(self):
+        '''
+        Rebuild the typed adjacency and node key indices from the rustworkx graph.
+        The topological order is rebuilt lazily by the next find_cycle().
+        '''
+        self._init_index()
+        for idx in self.node_indices():
+            self._add_to_index(idx)
+        for parent, child, edge in self.weighted_edge_list():
+            self._link(parent, child, edge)
+
+    # Incremental cycle detection
+    def _order_edge(self, parent, child):
+        '''
+        Pearce-Kelly insertion of edge parent -> child into the topological order.
+        '''
+        # Nothing to keep up to date if the graph is already cyclic or the order is unknown
+        if self._topo_order is None:
+            return
+
+        order = self._topo_order
+        lower, upper = order[child], order[parent]
+        if lower > upper:
+            return
+
+        # Forward search from child over the nodes placed before parent. Reaching parent 
+        # means the new edge closed a cycle.
+        forward = {child: None}
+        stack = [child]
+        while stack:
+            node = stack.pop()
+            for succ in self.successor_indices(node):
+                if succ == parent:
+                    forward[parent] = node
+                    self._set_cycle(parent, child, forward)
+                    return
+                if succ not in forward and order[succ] < upper:
+                    forward[succ] = node
+                    stack.append(succ)
+
+        # Backward search from parent over the nodes placed after child
+        backward = {parent}
+        stack = [parent]
+        while stack:
+            node = stack.pop()
+            for pred in self.predecessor_indices(node):
+                if pred not in backward and order[pred] > lower:
+                    backward.add(pred)
+                    stack.append(pred)
+
+        # Reuse the positions of both sets, placing everything reaching parent before
+        # everything reachable from child
+        if self._journal is not None:
+            self._journal.append(('order', {n: order[n] for n in chain(forward, backward)}))
+        forward_nodes = sorted(forward, key=order.get)
+        backward_nodes = sorted(backward, key=order.get)
+        positions = sorted(order[n] for n in chain(forward_nodes, backward_nodes))
+        for node, position in zip(chain(backward_nodes, forward_nodes), positions):
+            order[node] = position
+
+    def _set_cycle(self, parent, child, forward):
+        path = []
+        node = parent
+        while node != child:
+            path.append((forward[node], node))
+            node = forward[node]
+        path.reverse()
+        if self._journal is not None:
+            self._journal.append(('cycle', self._topo_order, self._next_order))
+        self._cycle = [(parent, child)] + path
+        self._closing_edge = (parent, child)
+        self._topo_order = None
+
+    def _unorder_node(self, node):
+        if self._topo_order is not None:
+            self._topo_order.pop(node, None)
+        elif self._cycle is not None and any(node in edge for edge in self._cycle):
+            self._cycle = None
+            self._closing_edge = None
+
+    def _unorder_edge(self, parent, child):
+        # Removing edges keeps a topological order valid, only a known cycle can break
+        if self._cycle is not None and (parent, child) in self._cycle:
+            self._cycle = None
+            self._closing_edge = None
+
+    def find_cycle(self):
+        '''
+        Edges (parent, child) of a cycle in the graph, empty if the graph is acyclic. 
+        Same contract as rustworkx.digraph_find_cycle, but answered from the incrementally 
+        kept topological order when possible. If a cycle was closed by an edge insertion,
+        that edge comes first (see closing_edge).
+        '''
+        if self._cycle is not None:
+            return list(self._cycle)
+        if self._topo_order is not None:
+            return []
+
+        cycle = list(rustworkx.digraph_find_cycle(self))
+        if cycle:
+            self._cycle = cycle
+            self._closing_edge = None
+        else:
+            self._topo_order = {node: i for i, node in enumerate(rustworkx.topological_sort(self))}
+            self._next_order = len(self._topo_order)
+        return cycle
+
+    def strongly_connected_components(self):
+        '''
+        Strongly connected components of the graph as lists of node indices.
+        '''
+        return [list(members) for members in rustworkx.strongly_connected_components(self)]
+
+    def cyclic_components(self):
+        '''
+        Strongly connected components with more than one node, i.e. the parts of the graph 
+        that are on a cycle. Empty if the graph is acyclic.
+        '''
+        return [members for members in self.strongly_connected_components() if len(members) > 1]
+
+    @property
+    def closing_edge(self):
+        '''
+        The inserted edge that closed the currently known cycle, None if the graph is 
+        acyclic or the cycle was found by a search over the whole graph.
+        '''
+        return self._closing_edge if self._cycle is not None else None
+
+    # Pickling/deepcopy goes through the rustworkx state, the index is rebuilt afterwards
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.rebuild_index()
+        self._init_journal()
+
+    def copy(self):
+        graph = CircuitGraph.__new__(CircuitGraph, self.check_cycle, self.multigraph, self.attrs)
+        graph.__setstate__(self.__getstate__())
+        # Node and edge indices are preserved, so the cycle tracking state carries over
+        if self._topo_order is not None:
+            graph._topo_order = dict(self._topo_order)
+            graph._next_order = self._next_order
+        elif self._cycle is not None:
+            graph._cycle = list(self._cycle)
+            graph._closing_edge = self._closing_edge
+        return graph
+
+    def clone(self):
+        '''
+        Copy of the graph for trying out uncomputation. The structure and the CGNode flags 
+        are copied, the CGNodeInfo of every node (and the qiskit objects in it) is shared.
+        '''
+        graph = self.copy()
+        for idx in graph.node_indices():
+            node = graph.get_node_data(idx)
+            # Same key, so the node index does not need to be updated
+            super(CircuitGraph, graph).__setitem__(
+                idx, node.clone() if isinstance(node, CGNode) else copy.deepcopy(node))
+        return graph
+
+    def __deepcopy__(self, memo):
+        return self.clone()
+
+    # Mutations
+    def add_node(self, obj):
+        node_index = super().add_node(obj)
+        self._add_to_index(node_index)
+        if self._journal is not None:
+            self._journal.append(('add_node', node_index))
+        return node_index
+
+    def add_nodes_from(self, obj_list):
+        return [self.add_node(obj) for obj in obj_list]
+
+    def add_child(self, parent, obj, edge):
+        node_index = self.add_node(obj)
+        self.add_edge(parent, node_index, edge)
+        return node_index
+
+    def add_parent(self, child, obj, edge):
+        node_index = self.add_node(obj)
+        self.add_edge(node_index, child, edge)
+        return node_index
+
+    def add_edge(self, parent, child, edge):
+        # Without multigraph, adding an existing edge only replaces its payload
+        replaces_edge = not self.multigraph and self.has_edge(parent, child)
+        if replaces_edge:
+            old_edge = self.get_edge_data(parent, child)
+            if old_edge != edge:
+                self._unlink(parent, child, old_edge)
+        if self._journal is not None:
+            self._journal.append(('replace_edge', parent, child, old_edge) if replaces_edge else ('add_edge', parent, child))
+        edge_index = super().add_edge(parent, child, edge)
+        self._link(parent, child, edge)
+        if not replaces_edge:
+            self._order_edge(parent, child)
+        return edge_index
+
+    def add_edges_from(self, obj_list):
+        return [self.add_edge(parent, child, edge) for parent, child, edge in obj_list]
+
+    def __setitem__(self, node, obj):
+        if self._journal is not None:
+            self._journal.append(('set_node', node, self.get_node_data(node)))
+        self._remove_node_key(node)
+        super().__setitem__(node, obj)
+        self._add_node_key(node)
+
+    def remove_node(self, node):
+        if self._journal is not None and self.has_node(node):
+            # Oldest edges first, so they are re-added in their original order
+            edges = list(reversed(self.in_edges(node))) + list(reversed(self.out_edges(node)))
+            position = self._topo_order.get(node) if self._topo_order is not None else None
+            self._journal.append(('remove_node', node, self.get_node_data(node), edges, position))
+        in_adj = self._in_adj.pop(node, None)
+        out_adj = self._out_adj.pop(node, None)
+        if in_adj is not None:
+            self._remove_node_key(node)
+            for edge_type in EdgeType:
+                for parent in in_adj[edge_type]:
+                    self._out_adj[parent][edge_type].pop(node, None)
+                for child in out_adj[edge_type]:
+                    self._in_adj[child][edge_type].pop(node, None)
+            self._unorder_node(node)
+        super().remove_node(node)
+
+    def remove_nodes_from(self, index_list):
+        for node in index_list:
+            self.remove_node(node)
+
+    def remove_edge(self, parent, child):
+        edge = self.get_edge_data(parent, child)
+        super().remove_edge(parent, child)
+        if self._journal is not None:
+            self._journal.append(('remove_edge', parent, child, edge))
+        self._unlink(parent, child, edge)
+        self._unorder_edge(parent, child)
+
+    def remove_edge_from_index(self, edge):
+        parent, child = self.get_edge_endpoints_by_index(edge)
+        payload = self.get_edge_data_by_index(edge)
+        super().remove_edge_from_index(edge)
+        if self._journal is not None:
+            self._journal.append(('remove_edge', parent, child, payload))
+        self._unlink(parent, child, payload)
+        self._unorder_edge(parent, child)
+
+    def remove_edges_from(self, index_list):
+        for parent, child in index_list:
+            self.remove_edge(parent, child)
+
+    def clear(self):
+        if self._journal is not None:
+            raise ValueError('Cannot clear a circuit graph inside a transaction')
+        super().clear()
+        self._init_index()
+        self._topo_order = {}
+
+    def clear_edges(self):
+        if self._journal is not None:
+            raise ValueError('Cannot clear a circuit graph inside a transaction')
+        super().clear_edges()
+        self.rebuild_index()
+
+    def set_node_flags(self, node, **flags):
+        '''
+        Set attributes (is_uncomputed, mark, ...) of the payload of 'node', journaled so 
+        that rollback() restores them.
+        '''
+        payload = self.get_node_data(node)
+        if self._journal is not None:
+            self._journal.append(('flags', node, {name: getattr(payload, name) for name in flags}))
+        for name, value in flags.items():
+            setattr(payload, name, value)
+
+    # Transactions
+    def checkpoint(self):
+        '''
+        Start journaling mutations, rollback() returns the graph to this point. 
+        Checkpoints can be nested.
+        '''
+        if self._journal is None:
+            self._journal = []
+        # Cycle tracking state to go back to
+        cycle = list(self._cycle) if self._cycle is not None else None
+        self._checkpoints.append((len(self._journal), self._topo_order is not None, cycle, self._closing_edge))
+
+    def commit(self):
+        '''
+        Keep the mutations since the last checkpoint. They stay in the journal of an 
+        enclosing checkpoint, if any.
+        '''
+        self._checkpoints.pop()
+        if len(self._checkpoints) == 0:
+            self._journal = None
+
+    def rollback(self):
+        '''
+        Undo the mutations since the last checkpoint, newest first.
+        '''
+        start, had_order, cycle, closing_edge = self._checkpoints.pop()
+        journal = self._journal
+
+        # Undo the structure with the topological order switched off, and put the order
+        # of the checkpoint back together from the journaled position changes
+        order, next_order = self._topo_order, self._next_order
+        self._topo_order = None
+        self._journal = None
+        while len(journal) > start:
+            entry = journal.pop()
+            kind = entry[0]
+            if kind == 'order':
+                if order is not None:
+                    order.update(entry[1])
+            elif kind == 'cycle':
+                # The order from right before the cycle was closed
+                order, next_order = entry[1], max(next_order, entry[2])
+            else:
+                self._undo(entry)
+                if order is not None:
+                    if kind == 'add_node':
+                        order.pop(entry[1], None)
+                    elif kind == 'remove_node' and entry[4] is not None:
+                        order[entry[1]] = entry[4]
+
+        self._topo_order = order if had_order else None
+        self._next_order = next_order
+        self._cycle = cycle
+        self._closing_edge = closing_edge
+        self._journal = journal if len(self._checkpoints) else None
+
+    def _undo(self, entry):
+        kind = entry[0]
+        if kind == 'add_node':
+            self.remove_node(entry[1])
+        elif kind == 'remove_node':
+            node, payload, edges = entry[1:4]
+            # Freed indices are reused last in first out, so the node gets its index back
+            restored = self.add_node(payload)
+            if restored != node:
+                raise ValueError(f'Rollback restored node {node} at index {restored}')
+            for parent, child, edge in edges:
+                self.add_edge(parent, child, edge)
+        elif kind == 'add_edge':
+            self.remove_edge(entry[1], entry[2])
+        elif kind in ('replace_edge', 'remove_edge'):
+            _, parent, child, edge = entry
+            self.add_edge(parent, child, edge)
+        elif kind == 'set_node':
+            self[entry[1]] = entry[2]
+        elif kind == 'flags':
+            payload = self.get_node_data(entry[1])
+            for name, value in entry[2].items():
+                setattr(payload, name, value)
+
+    # Node lookups
+    def find_node(self, label, node_num, node_type):
+        '''
+        Index of the node of qubit 'label' with the given node_num and node_type, None if 
+        there is no such node.
+        '''
+        return self._node_keys.get((label, node_num, node_type))
+
+    def wire_nodes(self, label, node_type=None):
+        '''
+        Indices of the INIT/COMP/UNCOMP nodes of qubit 'label', only of node_type if given, 
+        in increasing index order. Costs O(wire length) instead of a scan over nodes().
+        '''
+        wire = sorted(self._wire_nodes.get(label, ()))
+        if node_type is None:
+            return wire
+        return [idx for idx in wire if self.get_node_data(idx).node_type is node_type]
+
+    # Typed lookups
+    def predecessors_by_type(self, node, edge):
+        '''
+        Indices of nodes with an edge of type 'edge' going into 'node', most recent edge first.
+        '''
+        return list(reversed(self._in_adj[node][EDGE_TYPES[edge]]))
+
+    def successors_by_type(self, node, edge):
+        '''
+        Indices of nodes with an edge of type 'edge' coming out of 'node', most recent edge first.
+        '''
+        return list(reversed(self._out_adj[node][EDGE_TYPES[edge]]))
+
+    def controls_of(self, node):
+        '''
+        Nodes that control 'node' (incoming CONTROL edges).
+        '''
+        return self.predecessors_by_type(node, CONTROL)
+
+    def controlled_by(self, node):
+        '''
+        Nodes controlled by 'node' (outgoing CONTROL edges).
+        '''
+        return self.successors_by_type(node, CONTROL)
+
+    def target_pred(self, node):
+        '''
+        Previous node on the same wire (incoming TARGET edge), None for INIT nodes.
+        '''
+        preds = self._in_adj[node][EdgeType.TARGET]
+        return next(reversed(preds)) if preds else None
+
+    def target_succ(self, node):
+        '''
+        Next node on the same wire (outgoing TARGET edge), None for the last node of a wire.
+        '''
+        succs = self._out_adj[node][EdgeType.TARGET]
+        return next(reversed(succs)) if succs else None
@@ -10,6 +10,7 @@ import string
 
 from .constants import StringConstants
 from .graphhelper import CGNode, breakdown_qubit
+from .circuitgraph import CircuitGraph
 
 INPUT = StringConstants.INPUT.value
 ANCILLA = StringConstants.ANCILLA.value
@@ -25,7 +26,7 @@ ANTIDEP = StringConstants.ANTIDEP.value
 
 
 def get_computation_graph(circuit: qiskit.circuit.QuantumCircuit, ancillas: List, outputs: List=[]):
-    circuit_graph = rustworkx.PyDiGraph(multigraph=False)
+    circuit_graph = CircuitGraph(multigraph=False)
     last_node_index = {}
     # Add the initial qubits
 
@@ -45,9 +46,9 @@ def get_computation_graph(circuit: qiskit.circuit.QuantumCircuit, ancillas: List
         
                 
         init_node = CGNode(qubit_dict, qubit_type=qubit_type, node_type=INIT)
+        init_node.set_nodenum(0)
         index = circuit_graph.add_node(init_node)
         circuit_graph.get_node_data(index).set_index(index)
-        circuit_graph.get_node_data(index).set_nodenum(0)
         last_node_index[init_node.label] = index
 
     # print(circuit_graph.nodes())
@@ -95,33 +96,27 @@ def get_computation_graph(circuit: qiskit.circuit.QuantumCircuit, ancillas: List
         if len(params) == 1:
             opnode.theta = params[0]
 
-        opnode_index = circuit_graph.add_child(prev_node_index, opnode, TARGET)
-        circuit_graph.get_node_data(opnode_index).set_index(opnode_index)
-        circuit_graph.get_node_data(opnode_index).set_nodenum(
+        # The node num has to be set before adding, circuit graphs index nodes by it
+        opnode.set_nodenum(
             circuit_graph.get_node_data(prev_node_index).get_nodenum() + (1 if node_type is COMP else -1)
         )
+        opnode_index = circuit_graph.add_child(prev_node_index, opnode, TARGET)
+        circuit_graph.get_node_data(opnode_index).set_index(opnode_index)
         last_node_index[opnode.label] = opnode_index
 
         # Adding the control edges and Antidep between controls
         for qubit_index in qubit_indicies:
             circuit_graph.add_edge(qubit_index, opnode_index, CONTROL)        
             
-            controls_adj = circuit_graph.adj_direction(qubit_index, False)
-            try:
-                controls_target_idx = list(map(lambda x: x[0], list(filter(lambda x: x[1] == TARGET and not circuit_graph.has_edge(x[0], opnode_index), list(controls_adj.items())))))
-            except IndexError:
-                controls_target_idx = []
+            controls_target_idx = [x for x in circuit_graph.successors_by_type(qubit_index, TARGET) 
+                                   if not circuit_graph.has_edge(x, opnode_index)]
 
             for idx in controls_target_idx:
                 circuit_graph.add_edge(opnode_index, idx, ANTIDEP)
 
         # Adding AntiDep Edges (Opnode to OTHER controlled nodes)
-        prev_node_adj = circuit_graph.adj_direction(prev_node_index, False)
-        # print(prev_node_adj)
-        try:
-            prev_node_controlled_idx = list(map(lambda x: x[0], list(filter(lambda x: x[1] == CONTROL and not circuit_graph.has_edge(x[0], opnode_index), list(prev_node_adj.items())))))
-        except IndexError:
-            prev_node_controlled_idx = []
+        prev_node_controlled_idx = [x for x in circuit_graph.controlled_by(prev_node_index) 
+                                    if not circuit_graph.has_edge(x, opnode_index)]
 
         for idx in prev_node_controlled_idx:
             circuit_graph.add_edge(idx, opnode_index, ANTIDEP)
@@ -136,9 +131,9 @@ def get_computation_graph(circuit: qiskit.circuit.QuantumCircuit, ancillas: List
     return circuit_graph
 
 
-def get_uncomp_circuit(circuit_graph: rustworkx.PyDiGraph):
+def get_uncomp_circuit(circuit_graph: CircuitGraph):
     
-    sorted_circuit_graph = rustworkx.topological_sort(copy.deepcopy(circuit_graph))
+    sorted_circuit_graph = rustworkx.topological_sort(circuit_graph)
     # print(sorted_circuit_graph)
 
     init_nodes = list(filter(lambda x: x.node_type == INIT, circuit_graph.nodes()))
@@ -160,17 +155,8 @@ def get_uncomp_circuit(circuit_graph: rustworkx.PyDiGraph):
         node = circuit_graph.get_node_data(idx) 
         # print(node)
         
-        node_incoming_edges = circuit_graph.adj_direction(idx, True)
-        
-        try:
-            node_prev_idx = list(filter(lambda x: x[1] == TARGET, list(node_incoming_edges.items()))).pop()[0]
-        except IndexError:
-            node_prev_idx = None
-
-        try:
-            node_controls_idx = list(map(lambda x: x[0], list(filter(lambda x: x[1] == CONTROL, list(node_incoming_edges.items())))))
-        except IndexError:
-            node_controls_idx = []
+        node_prev_idx = circuit_graph.target_pred(idx)
+        node_controls_idx = circuit_graph.controls_of(idx)
 
         # node_controls = circuit_graph.find_successors_by_edge(idx, lambda x:x==CONTROL)
         # print(node_prev_idx)
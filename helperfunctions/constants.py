@@ -1,4 +1,4 @@
-from enum import Enum
+from enum import Enum, IntEnum
 from typing import Literal
 
 
@@ -18,6 +18,13 @@ class StringConstants(Enum):
     CONTROL = 'control'
     ANTIDEP = 'anti-dependence'
 
+# Small integer codes for the edge types, used by the typed adjacency 
+# index of CircuitGraph instead of comparing edge payload strings.
+class EdgeType(IntEnum):
+    TARGET = 0
+    CONTROL = 1
+    ANTIDEP = 2
+
 
 # UNCOMP_TYPES = Literal['regular', 'exhaustive', 'greedy-full', 'greedy-partial']
 
@@ -26,6 +33,8 @@ class UncompType(Enum):
     EXHAUSTIVE = 'exhaustive'
     GREEDY_FULL = 'greedy-full'
     GREEDY_PARTIAL = 'greedy-partial'
+    MILP = 'milp'
+    BEAM = 'beam'
 
 class ListConstants(Enum):
 
@@ -1,3 +1,6 @@
+from operator import attrgetter
+import sys
+from typing import NamedTuple, Optional
 import qiskit
 from .constants import StringConstants
 
@@ -9,27 +12,91 @@ TARGET = StringConstants.TARGET.value
 CONTROL = StringConstants.CONTROL.value
 ANTIDEP = StringConstants.ANTIDEP.value
 
+class CGNodeInfo(NamedTuple):
+    '''
+    The immutable part of a CGNode (qubit, gate and position on the wire). It is shared 
+    between all copies of a node, so copying a circuit graph never copies qiskit objects.
+    '''
+    qubit: qiskit.circuit.Qubit
+    qubit_wire: int
+    qubit_name: str
+    label: str
+    qubit_dict: dict
+    qubit_type: Optional[str] = None
+    node_type: Optional[str] = None
+    opname: Optional[str] = None
+    theta: float = 0.0
+    node_num: int = -1
+
+
+def _shared_field(name):
+    # Copy-on-write access to a CGNodeInfo field, setting it only changes this node
+    def setter(self, value):
+        self.info = self.info._replace(**{name: value})
+    return property(attrgetter(f'info.{name}'), setter)
+
+
+# Node of a circuit graph. The qubit/gate description lives in a CGNodeInfo shared by all 
+# copies of the node, the node itself only holds its index and the flags changed while 
+# uncomputing (mark, is_uncomputed, uncomp_node_index, important_for_uncomp).
 class CGNode:
+    __slots__ = ('info', 'index', 'mark', 'is_uncomputed', 'uncomp_node_index', 'important_for_uncomp')
+
     def __init__(self, qubit_dict, qubit_type=None, node_type=None, opname=None):
-        self.qubit = qubit_dict['qubit']
-        self.qubit_wire = qubit_dict['wire']
-        self.qubit_name = qubit_dict['name']
-        self.label = qubit_dict['label']
-        self.qubit_dict = qubit_dict
+        self.info = CGNodeInfo(qubit=qubit_dict['qubit'], qubit_wire=qubit_dict['wire'], 
+                               qubit_name=qubit_dict['name'], label=qubit_dict['label'], 
+                               qubit_dict=qubit_dict, qubit_type=qubit_type, 
+                               node_type=node_type, opname=opname)
 
         self.index = -1
-        self.qubit_type = qubit_type
-        self.node_type = node_type
-        self.opname = opname
-        self.node_num = -1
         self.mark = False
-        self.theta = 0.0
         self.is_uncomputed = False
 
         self.uncomp_node_index = -1
 
         self.important_for_uncomp = False
 
+    qubit = _shared_field('qubit')
+    qubit_wire = _shared_field('qubit_wire')
+    qubit_name = _shared_field('qubit_name')
+    label = _shared_field('label')
+    qubit_dict = _shared_field('qubit_dict')
+    qubit_type = _shared_field('qubit_type')
+    node_type = _shared_field('node_type')
+    opname = _shared_field('opname')
+    theta = _shared_field('theta')
+    node_num = _shared_field('node_num')
+
+    def clone(self):
+        '''
+        Copy of the node that shares its CGNodeInfo and copies only the mutable flags.
+        '''
+        node = CGNode.__new__(CGNode)
+        node.info = self.info
+        node.index = self.index
+        node.mark = self.mark
+        node.is_uncomputed = self.is_uncomputed
+        node.uncomp_node_index = self.uncomp_node_index
+        node.important_for_uncomp = self.important_for_uncomp
+        return node
+
+    def __copy__(self):
+        return self.clone()
+
+    def __deepcopy__(self, memo):
+        return self.clone()
+
+    def __setstate__(self, state):
+        # Node and qubit types are compared with 'is', so the strings of an unpickled 
+        # node (e.g. in a worker process) have to be the interned constants again.
+        _, slots = state
+        info = slots['info']
+        slots['info'] = info._replace(**{name: sys.intern(getattr(info, name)) 
+                                         for name in ('label', 'qubit_name', 'qubit_type', 'node_type', 'opname') 
+                                         if isinstance(getattr(info, name), str)})
+        for name, value in slots.items():
+            setattr(self, name, value)
+
     def set_index(self, index):
         self.index = index
     def get_index(self):
@@ -1,5 +1,5 @@
 import collections
-import copy
+import heapq
 from itertools import chain, combinations
 import time
 from typing import Dict, List
@@ -8,9 +8,10 @@ from qiskit import QuantumCircuit
 import rustworkx
 from tqdm import tqdm
 
-from .uncompfunctions import add_uncomputation_step, remove_uncomputation_step
+from .uncompfunctions import add_uncomputation_step, remove_uncomputation_step, remove_uncomputation_full, get_deadline, deadline_passed
 from .constants import StringConstants, ListConstants
 from .graphhelper import CGNode, breakdown_qubit
+from .circuitgraph import CircuitGraph
 
 INPUT = StringConstants.INPUT.value
 ANCILLA = StringConstants.ANCILLA.value
@@ -30,8 +31,8 @@ NON_QFREE = ListConstants.NON_QFREE.value
 logger = logging.getLogger(__name__)
 
  
-def reverse_all_operations(circuit_graph : rustworkx.PyDiGraph):
-    uncomp_circuit_graph = copy.deepcopy(circuit_graph)
+def reverse_all_operations(circuit_graph : CircuitGraph):
+    uncomp_circuit_graph = circuit_graph.clone()
     nodelist = list(rustworkx.topological_sort(circuit_graph))
     nodelist.reverse()
     for id in nodelist:
@@ -43,8 +44,8 @@ def reverse_all_operations(circuit_graph : rustworkx.PyDiGraph):
     
     return uncomp_circuit_graph
 
-def uncomp_all_operations_using_bennetts_in_circuitgraph(circuit_graph : rustworkx.PyDiGraph):
-    uncomp_circuit_graph = copy.deepcopy(circuit_graph)
+def uncomp_all_operations_using_bennetts_in_circuitgraph(circuit_graph : CircuitGraph):
+    uncomp_circuit_graph = circuit_graph.clone()
     nodelist = list(rustworkx.topological_sort(circuit_graph))
     nodelist.reverse()
     for id in nodelist:
@@ -57,7 +58,7 @@ def uncomp_all_operations_using_bennetts_in_circuitgraph(circuit_graph : rustwor
     return uncomp_circuit_graph
 
 
-def add_uncomp_input_node(node_index: int, circuit_graph:rustworkx.PyDiGraph):
+def add_uncomp_input_node(node_index: int, circuit_graph:CircuitGraph):
     '''
     Algorithm for adding uncomp for an input qubit node/gate. 
     1.  Get node 'c' to uncompute. Get node_num 'i' of this node. 
@@ -80,20 +81,16 @@ def add_uncomp_input_node(node_index: int, circuit_graph:rustworkx.PyDiGraph):
     qubit = comp_node.label
     # print(node_num)
 
-    incoming_edges = circuit_graph.adj_direction(node_index, True)
-    outgoing_edges = circuit_graph.adj_direction(node_index, False)
-
     # 2.  If node has a target edge and uncomp node of qubit with node_num 'i' 
     #     does not exist, then recursively uncompute node with node_num 'i'
 
-    target = [x[0] for x in outgoing_edges.items() if x[1] is TARGET]
-    uncomped = [node for node in circuit_graph.nodes() \
-                if node.label == qubit and node.get_nodenum() == node_num and node.node_type is UNCOMP]
+    target = circuit_graph.successors_by_type(node_index, TARGET)
+    uncomped = circuit_graph.find_node(qubit, node_num, UNCOMP)
     
     # print(target)
     # print(uncomped)
 
-    if  len(target) and not len(uncomped):
+    if  len(target) and uncomped is None:
 
         assert len(target) == 1, f'Target List has more than 1 node, this is wrong.'
         to_be_uncomped = target[0]
@@ -114,18 +111,17 @@ def add_uncomp_input_node(node_index: int, circuit_graph:rustworkx.PyDiGraph):
     # print(uncomp_node)
 
     # Step 5
-    prev_node = [x for x,y in incoming_edges.items() if y == TARGET]
+    prev_node = circuit_graph.predecessors_by_type(node_index, TARGET)
     
     assert len(prev_node) == 1
     c_node = prev_node[0]
-    c_node_outgoing_edges = circuit_graph.adj_direction(c_node, False)
 
 
     # 5.1 Any control edges to UNCOMP nodes from c will be redirected to c*
     # 5.2 Anti dep edges from any UNCOMP node to node 'i' where node 'c' is the control can be removed
 
-    uncomp_nodes_controlled = [x for x,y in c_node_outgoing_edges.items() \
-                               if y == CONTROL and circuit_graph.get_node_data(x).node_type == UNCOMP]
+    uncomp_nodes_controlled = [x for x in circuit_graph.controlled_by(c_node) 
+                               if circuit_graph.get_node_data(x).node_type == UNCOMP]
     
     # edges_to_remove = [x for x,y in incoming_edges.items()\
     #                  if y == ANTIDEP and circuit_graph.get_node_data(x).node_type == UNCOMP]
@@ -142,7 +138,7 @@ def add_uncomp_input_node(node_index: int, circuit_graph:rustworkx.PyDiGraph):
     # for n in edges_to_remove:
     #     circuit_graph.remove_edge(n,node_index)
 
-    has_cycle = rustworkx.digraph_find_cycle(circuit_graph)
+    has_cycle = circuit_graph.find_cycle()
     if has_cycle:
         print(f'Added Uncomp for {comp_node.simple_graph_label()} but CG has cycles')
     else:
@@ -152,7 +148,7 @@ def add_uncomp_input_node(node_index: int, circuit_graph:rustworkx.PyDiGraph):
     return circuit_graph
 
 
-def remove_uncomp_input_node(node_index: int, circuit_graph:rustworkx.PyDiGraph):
+def remove_uncomp_input_node(node_index: int, circuit_graph:CircuitGraph):
     '''
     Algorithm for removing uncomp for an input qubit node. 
     1.  
@@ -163,7 +159,7 @@ def remove_uncomp_input_node(node_index: int, circuit_graph:rustworkx.PyDiGraph)
 
     pass
 
-# def reverse_input_qubits(circuit_graph:rustworkx.PyDiGraph):
+# def reverse_input_qubits(circuit_graph:CircuitGraph):
 #     input_init_nodes = [node for node in circuit_graph.nodes() if node.node_type == INIT and node.qubit_type is not ANCILLA]
 #     input_qubits = [node.label for node in input_init_nodes]
 #     input_qubits_counter = collections.Counter(input_qubits)
@@ -188,16 +184,16 @@ def remove_uncomp_input_node(node_index: int, circuit_graph:rustworkx.PyDiGraph)
 #     pass
 
 
-def greedy_metric_num_uncomp_antidep(node_index:int, circuit_graph:rustworkx.PyDiGraph):
+def greedy_metric_num_uncomp_antidep(node_index:int, circuit_graph:CircuitGraph):
     '''
     The greedy metric here is most number of anti dependency edges from ancilla uncomp nodes 
     that come into the node.
     '''
-    return len([x for x,y in circuit_graph.adj_direction(node_index, True).items() 
-                        if y is ANTIDEP and circuit_graph.get_node_data(x).qubit_type is ANCILLA 
+    return len([x for x in circuit_graph.predecessors_by_type(node_index, ANTIDEP) 
+                        if circuit_graph.get_node_data(x).qubit_type is ANCILLA 
                         and circuit_graph.get_node_data(x).node_type is UNCOMP])
 
-def greedily_select_input_node(circuit_graph:rustworkx.PyDiGraph):
+def greedily_select_input_node(circuit_graph:CircuitGraph):
     '''
     This method determines the best input qubit to uncompute by choosing the input qubit
     with the specified greedy metric. 
@@ -219,12 +215,117 @@ def greedily_select_input_node(circuit_graph:rustworkx.PyDiGraph):
 
     return best_index
 
-def uncompute_input_nodes_greedy(circuit_graph:rustworkx.PyDiGraph):
-    while rustworkx.digraph_find_cycle(circuit_graph):
-        best_node_to_uncompute = greedily_select_input_node(circuit_graph)
+# Heap version of greedily_select_input_node, for the repeated selections of 
+# uncompute_input_nodes_greedy
+class InputNodeSelector:
+    '''
+    Heap of the INPUT COMP nodes that are not uncomputed yet, keyed on 
+    greedy_metric_num_uncomp_antidep and then node index, so select() returns the 
+    node greedily_select_input_node would. Entries are checked when they come to the 
+    top, and update() pushes the nodes whose metric changed again.
+    '''
+    def __init__(self, circuit_graph:CircuitGraph):
+        self.circuit_graph = circuit_graph
+        self.metric = {}
+        self.heap = []
+        for idx in circuit_graph.node_indices():
+            if self.is_candidate(idx):
+                self.push(idx)
+
+    def is_candidate(self, idx):
+        if not self.circuit_graph.has_node(idx):
+            return False
+        node = self.circuit_graph.get_node_data(idx)
+        return node.qubit_type is INPUT and node.node_type is COMP and not node.is_uncomputed
+
+    def push(self, idx):
+        self.metric[idx] = greedy_metric_num_uncomp_antidep(idx, self.circuit_graph)
+        heapq.heappush(self.heap, (-self.metric[idx], idx))
+
+    def select(self):
+        while len(self.heap):
+            metric, idx = self.heap[0]
+            if self.is_candidate(idx) and self.metric.get(idx) == -metric:
+                return idx
+            heapq.heappop(self.heap)
+        # Same as greedily_select_input_node without any input node left
+        return 0
+
+    def update(self, touched):
+        for idx in touched:
+            if not self.is_candidate(idx):
+                self.metric.pop(idx, None)
+            elif greedy_metric_num_uncomp_antidep(idx, self.circuit_graph) != self.metric.get(idx):
+                self.push(idx)
+
+# Fallback for uncompute_input_nodes_greedy when it runs out of time
+def remove_cyclic_input_uncomputation(circuit_graph:CircuitGraph):
+    '''
+    Remove all uncomp nodes of the ancillas with an uncomp node in a cyclic component, 
+    and of the inputs once no such ancilla is left, until the graph is acyclic. 
+    Input uncomp nodes can close cycles of their own, without any ancilla uncomp. 
+    Returns the labels whose uncomp was removed.
+    '''
+    removed = []
+    cycle_check = circuit_graph.cyclic_components()
+    while len(cycle_check) > 0:
+        in_cycles = {ANCILLA: [], INPUT: []}
+        for component in cycle_check:
+            for idx in component:
+                node = circuit_graph.get_node_data(idx)
+                if node.node_type is UNCOMP and node.qubit_type in in_cycles and node.label not in in_cycles[node.qubit_type]:
+                    in_cycles[node.qubit_type].append(node.label)
+        to_remove = in_cycles[ANCILLA] or in_cycles[INPUT]
+        if len(to_remove) == 0:
+            # Cycles only through comp nodes, drop all uncomp left
+            to_remove = list({circuit_graph.get_node_data(idx).label for idx in circuit_graph.node_indices() 
+                              if circuit_graph.get_node_data(idx).node_type is UNCOMP})
+            if len(to_remove) == 0:
+                raise ValueError('Computation graph has a cycle without any uncomp nodes')
+
+        remove_uncomputation_full(circuit_graph, to_remove)
+        removed.extend(to_remove)
+        cycle_check = circuit_graph.cyclic_components()
+
+    return removed
+
+def uncompute_input_nodes_greedy(circuit_graph:CircuitGraph, time_budget:float=None):
+    '''
+    With a time_budget in seconds, input nodes are added until it runs out, and the 
+    result is the graph with a flag, True if all cycles were broken. If the flag is 
+    False, the uncomp still on cycles was removed with remove_cyclic_input_uncomputation, 
+    so the graph is acyclic either way.
+    Nodes are selected with an InputNodeSelector. Adding uncomp for an input node only 
+    changes the edges of the nodes it uncomputes on that wire and of their new uncomp 
+    nodes, so only those are scored again.
+    '''
+    deadline = get_deadline(time_budget)
+    converged = True
+    selector = InputNodeSelector(circuit_graph)
+    while len(circuit_graph.find_cycle()) > 0:
+        if deadline_passed(deadline):
+            logger.info(f'Greedy input node uncomp ran out of time, removing the uncomp still in cycles')
+            removed = remove_cyclic_input_uncomputation(circuit_graph)
+            logger.info(f'Removed the uncomp of {removed}')
+            converged = False
+            break
+        best_node_to_uncompute = selector.select()
         print(f'Best Node to uncompute is {best_node_to_uncompute} : {circuit_graph.get_node_data(best_node_to_uncompute).simple_graph_label()}')
+        
+        label = circuit_graph.get_node_data(best_node_to_uncompute).label
+        uncomputed = {idx for idx in circuit_graph.wire_nodes(label, COMP) if circuit_graph.get_node_data(idx).is_uncomputed}
         add_uncomp_input_node(best_node_to_uncompute, circuit_graph)
+
+        touched = set()
+        for idx in circuit_graph.wire_nodes(label, COMP):
+            node = circuit_graph.get_node_data(idx)
+            if node.is_uncomputed and idx not in uncomputed:
+                touched.add(idx)
+                touched.update(circuit_graph.successor_indices(node.uncomp_node_index))
+        selector.update(touched)
     
+    if deadline is not None:
+        return circuit_graph, converged
     return circuit_graph
 
 def get_bennetts_reduced_uncomp_without_reordering(circuit: QuantumCircuit, ancillas: List, num_gates:int):
@@ -249,7 +350,7 @@ def get_bennetts_reduced_uncomp_without_reordering(circuit: QuantumCircuit, anci
     return benentts_uncomp_circuit
     
 
-def remove_nodes_not_in_bennetts(all_uncomp_graph:rustworkx.PyDiGraph, bennetts_uncomp_graph:rustworkx.PyDiGraph, matcher_func):
+def remove_nodes_not_in_bennetts(all_uncomp_graph:CircuitGraph, bennetts_uncomp_graph:CircuitGraph, matcher_func):
     # Pre-compute all potential matches for faster lookup
     nodes_to_remove = []
     new_uncomp_graph = all_uncomp_graph.copy()
@@ -271,9 +372,9 @@ def remove_nodes_not_in_bennetts(all_uncomp_graph:rustworkx.PyDiGraph, bennetts_
     return new_uncomp_graph
     
 
-def remove_input_nodes_until_required_breaking(circuit_graph:rustworkx.PyDiGraph):
+def remove_input_nodes_until_required_breaking(circuit_graph:CircuitGraph):
 
-    uncomp_circuit_graph = copy.deepcopy(circuit_graph)
+    uncomp_circuit_graph = circuit_graph.clone()
 
     input_init_nodes = [node for node in uncomp_circuit_graph.nodes() if node.node_type == INIT and node.qubit_type is INPUT]
     input_qubits = [node.label for node in input_init_nodes]
@@ -288,17 +389,11 @@ def remove_input_nodes_until_required_breaking(circuit_graph:rustworkx.PyDiGraph
     for node in ancilla_init_nodes:
         qubit = node.label
         targets = []
-        try:
-            target_node = uncomp_circuit_graph.find_adjacent_node_by_edge(node.get_index(), lambda x : x == TARGET)
-        except rustworkx.NoSuitableNeighbors:
-            target_node = None
-
-        while target_node:
-            targets.append(target_node)
-            try:
-                target_node = uncomp_circuit_graph.find_adjacent_node_by_edge(target_node.get_index(), lambda x : x == TARGET)
-            except:
-                target_node = None
+        target_idx = uncomp_circuit_graph.target_succ(node.get_index())
+
+        while target_idx is not None:
+            targets.append(uncomp_circuit_graph.get_node_data(target_idx))
+            target_idx = uncomp_circuit_graph.target_succ(target_idx)
 
         targets.reverse()
 
@@ -318,8 +413,8 @@ def remove_input_nodes_until_required_breaking(circuit_graph:rustworkx.PyDiGraph
     for anc, anc_targs in ancilla_target_nodes.items():
         for t in anc_targs:
             t_idx = t.get_index()
-            controls_idx = [x for x,y in uncomp_circuit_graph.adj_direction(t_idx, True).items() 
-                            if y == CONTROL and uncomp_circuit_graph.get_node_data(x).qubit_type == INPUT and uncomp_circuit_graph.get_node_data(x).node_type == UNCOMP] # Get all inbound uncomp control edges
+            controls_idx = [x for x in uncomp_circuit_graph.controls_of(t_idx) 
+                            if uncomp_circuit_graph.get_node_data(x).qubit_type == INPUT and uncomp_circuit_graph.get_node_data(x).node_type == UNCOMP] # Get all inbound uncomp control edges
             print(t_idx, controls_idx)
             for c in controls_idx:
                 c_node = uncomp_circuit_graph.get_node_data(c)
@@ -338,8 +433,8 @@ def remove_input_nodes_until_required_breaking(circuit_graph:rustworkx.PyDiGraph
             if node is None:
                 continue
             c_idx = node.get_index()
-            controls_idx = [x for x,y in uncomp_circuit_graph.adj_direction(c_idx, True).items() 
-                            if y == CONTROL and uncomp_circuit_graph.get_node_data(x).qubit_type == INPUT and uncomp_circuit_graph.get_node_data(x).node_type == UNCOMP] # Get all inbound uncomp control edges
+            controls_idx = [x for x in uncomp_circuit_graph.controls_of(c_idx) 
+                            if uncomp_circuit_graph.get_node_data(x).qubit_type == INPUT and uncomp_circuit_graph.get_node_data(x).node_type == UNCOMP] # Get all inbound uncomp control edges
             print(t_idx, controls_idx)
             for c in controls_idx:
                 c_node = uncomp_circuit_graph.get_node_data(c)
@@ -365,39 +460,33 @@ def remove_input_nodes_until_required_breaking(circuit_graph:rustworkx.PyDiGraph
     return uncomp_circuit_graph
 
 
-def mark_important_input_controls(node_idx:int, circuit_graph:rustworkx.PyDiGraph):
+def mark_important_input_controls(node_idx:int, circuit_graph:CircuitGraph):
     # Get incoming control and target edges
-    node_controls = [x for x,y in circuit_graph.adj_direction(node_idx, True).items() if y == CONTROL or y == TARGET]
+    node_controls = circuit_graph.controls_of(node_idx) + circuit_graph.predecessors_by_type(node_idx, TARGET)
     # print(f'The node controls are {node_controls}')
     for ctrl in node_controls:
         node = circuit_graph.get_node_data(ctrl)
         if not node.important_for_uncomp:
-            node.important_for_uncomp = True
+            circuit_graph.set_node_flags(ctrl, important_for_uncomp=True)
 
             # print(f'Marking Control Nodes for {circuit_graph.get_node_data(ctrl)}')
             mark_important_input_controls(ctrl, circuit_graph)
     
 
 
-def remove_input_nodes_until_required(circuit_graph: rustworkx.PyDiGraph):
+def remove_input_nodes_until_required(circuit_graph: CircuitGraph):
 
-    uncomp_circuit_graph = copy.deepcopy(circuit_graph)
+    uncomp_circuit_graph = circuit_graph.clone()
     input_init_nodes = [node for node in uncomp_circuit_graph.nodes() if node.node_type == INIT and node.qubit_type is INPUT]
     input_qubits = [node.label for node in input_init_nodes]
     input_target_dict = {q:[] for q in input_qubits}
     
     for node in input_init_nodes:
-        try:
-            target_node = uncomp_circuit_graph.find_adjacent_node_by_edge(node.get_index(), lambda x: x == TARGET)
-        except rustworkx.NoSuitableNeighbors:
-            target_node = None
-
-        while target_node is not None:
-            input_target_dict[node.label].append(target_node)
-            try:
-                target_node = uncomp_circuit_graph.find_adjacent_node_by_edge(target_node.get_index(), lambda x: x == TARGET)
-            except rustworkx.NoSuitableNeighbors:
-                target_node = None
+        target_idx = uncomp_circuit_graph.target_succ(node.get_index())
+
+        while target_idx is not None:
+            input_target_dict[node.label].append(uncomp_circuit_graph.get_node_data(target_idx))
+            target_idx = uncomp_circuit_graph.target_succ(target_idx)
         
         input_target_dict[node.label].reverse()
 
@@ -407,7 +496,7 @@ def remove_input_nodes_until_required(circuit_graph: rustworkx.PyDiGraph):
     
     for node in ancilla_uncomp_nodes:
         node_idx = node.get_index()
-        node_controls = [x for x,y in circuit_graph.adj_direction(node_idx, True).items() if y == CONTROL]
+        node_controls = circuit_graph.controls_of(node_idx)
         print(node_controls)
 
         mark_important_input_controls(node_idx, uncomp_circuit_graph)
@@ -1,14 +1,25 @@
 import collections
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import copy
-from itertools import chain, combinations
+import hashlib
+from itertools import chain, combinations, islice
 import time
-from typing import Dict, List
+from typing import Dict, List, Literal
 import logging
+import math
+import multiprocessing
+import numpy
+import random
 import rustworkx
+import scipy.optimize
+import scipy.sparse
+import scipy.sparse.linalg
 from tqdm import tqdm
 
-from .constants import StringConstants, ListConstants
+from .constants import StringConstants, UncompType, ListConstants
 from .graphhelper import CGNode
+from .circuitgraph import CircuitGraph
+from .circuitgraphfunctions import get_uncomp_circuit
 
 
 ANCILLA = StringConstants.ANCILLA.value
@@ -28,28 +39,23 @@ logger = logging.getLogger(__name__)
 
 # This method is to implement Lines 10,11 of the PLDI algorithm
 # If to uncomp node, ctrl* exists, replace ctrl with ctrl*
-def get_uncomp_node_index(circuit_graph: rustworkx.PyDiGraph, node_index):
-    for node in circuit_graph.nodes():
-        if node.node_type is UNCOMP \
-            and node.label == circuit_graph.get_node_data(node_index).label \
-            and node.get_nodenum() == circuit_graph.get_node_data(node_index).get_nodenum():
-            
-            return node.get_index()
-    return node_index
+def get_uncomp_node_index(circuit_graph: CircuitGraph, node_index):
+    node = circuit_graph.get_node_data(node_index)
+    uncomp_node_index = circuit_graph.find_node(node.label, node.get_nodenum(), UNCOMP)
+    return node_index if uncomp_node_index is None else uncomp_node_index
 
 # This method is to reverse Lines 10,11 of the PLDI algorithm
 # If we remove uncomp node, and node acts as a control, replace with ctrl* with ctrl
-def get_comp_node_index(circuit_graph: rustworkx.PyDiGraph, node_index):
-    for node in circuit_graph.nodes():
-        if node.node_type is not UNCOMP \
-            and node.label == circuit_graph.get_node_data(node_index).label \
-            and node.get_nodenum() == circuit_graph.get_node_data(node_index).get_nodenum():
-
-            return node.get_index()
+def get_comp_node_index(circuit_graph: CircuitGraph, node_index):
+    node = circuit_graph.get_node_data(node_index)
+    for node_type in (COMP, INIT):
+        comp_node_index = circuit_graph.find_node(node.label, node.get_nodenum(), node_type)
+        if comp_node_index is not None:
+            return comp_node_index
     return node_index
 
 
-def add_uncomputation_step(circuit_graph: rustworkx.PyDiGraph, idx, return_uncomp_node = False):
+def add_uncomputation_step(circuit_graph: CircuitGraph, idx, return_uncomp_node = False):
     '''
     PLDI's UncompStep implementation
     '''
@@ -60,23 +66,17 @@ def add_uncomputation_step(circuit_graph: rustworkx.PyDiGraph, idx, return_uncom
         print(f'The node {node.simple_graph_label()} of index {idx} is already uncomputed.')
 
         if return_uncomp_node:
-            return node.uncomp_node_index, rustworkx.digraph_find_cycle(circuit_graph)
+            return node.uncomp_node_index, circuit_graph.find_cycle()
         else:
-            return rustworkx.digraph_find_cycle(circuit_graph)
-
+            return circuit_graph.find_cycle()
 
-    # Get all the edges coming into the node
-    node_adj = circuit_graph.adj_direction(idx, True)
 
     # Check, may need to modify?
     if node.qubit_type is ANCILLA:
         assert node.opname not in NON_QFREE
 
-    # Filter all the incoming edges to get the control edges controlling the node.
-    try:
-        node_controls_idx = list(map(lambda x: x[0], list(filter(lambda x: x[1] == CONTROL, list(node_adj.items())))))
-    except IndexError:
-        node_controls_idx = []
+    # Get the control edges controlling the node.
+    node_controls_idx = circuit_graph.controls_of(idx)
 
     # print(node_controls_idx)
 
@@ -85,46 +85,34 @@ def add_uncomputation_step(circuit_graph: rustworkx.PyDiGraph, idx, return_uncom
     # print(node_controls_idx_uncomp)
 
     # Get the previous node. a[n] if first uncomp else a*[n-1]
-    prev_node_index = node.get_index()
-    for n in circuit_graph.nodes():
-        if n.label == node.label and n.node_type is UNCOMP and n.get_nodenum() == node.get_nodenum():
-            prev_node_index = n.get_index()
+    prev_node_index = circuit_graph.find_node(node.label, node.get_nodenum(), UNCOMP)
+    if prev_node_index is None:
+        prev_node_index = node.get_index()
 
     # print(prev_node_index)
 
     # Build and add the uncomp node to the circuit graph
     uncomp_node = CGNode(node.qubit_dict, qubit_type=node.qubit_type, node_type=UNCOMP, opname=node.opname)
+    uncomp_node.set_nodenum(node.get_nodenum() - 1)
     # uncomp_node_index = circuit_graph.add_node(uncomp_node)
     uncomp_node_index = circuit_graph.add_child(prev_node_index, uncomp_node, TARGET)
     circuit_graph.get_node_data(uncomp_node_index).set_index(uncomp_node_index)
-    circuit_graph.get_node_data(uncomp_node_index).set_nodenum(
-        circuit_graph.get_node_data(node.get_index()).get_nodenum() - 1
-    )
-    node.uncomp_node_index = uncomp_node_index
 
     # Adding Control Edges and the antidep of control edges. 
     # a*[n-1] - -> v | c --> v (c in ctrls of a*[n-1])
     for control_idx in node_controls_idx_uncomp:
         circuit_graph.add_edge(control_idx, uncomp_node_index, CONTROL)
 
-        controls_adj = circuit_graph.adj_direction(control_idx, False)
-        try:
-            controls_target_idx = list(map(lambda x: x[0], list(filter(lambda x: x[1] == TARGET and not circuit_graph.has_edge(x[0], uncomp_node_index), 
-                                                                       list(controls_adj.items())))))
-        except IndexError:
-            controls_target_idx = []
+        controls_target_idx = [x for x in circuit_graph.successors_by_type(control_idx, TARGET) 
+                               if not circuit_graph.has_edge(x, uncomp_node_index)]
 
         for idx in controls_target_idx:
             circuit_graph.add_edge(uncomp_node_index, idx, ANTIDEP)
 
     # Add anti dependency edges between nodes controlled by of node and new uncomp node
     # v - -> a*[n-1] | a*n o--> v (any v in G)
-    prev_node_adj = circuit_graph.adj_direction(prev_node_index, False)
-    # print(prev_node_adj)
-    try:
-        prev_node_controlled_idx = list(map(lambda x: x[0], list(filter(lambda x: x[1] == CONTROL and not circuit_graph.has_edge(x[0], uncomp_node_index), list(prev_node_adj.items())))))
-    except IndexError:
-        prev_node_controlled_idx = []
+    prev_node_controlled_idx = [x for x in circuit_graph.controlled_by(prev_node_index) 
+                                if not circuit_graph.has_edge(x, uncomp_node_index)]
 
     for idx in prev_node_controlled_idx:
         circuit_graph.add_edge(idx, uncomp_node_index, ANTIDEP)
@@ -134,25 +122,431 @@ def add_uncomputation_step(circuit_graph: rustworkx.PyDiGraph, idx, return_uncom
 
     # print('----------------------------------------')
 
-    node.is_uncomputed = True
+    circuit_graph.set_node_flags(node.get_index(), is_uncomputed=True, uncomp_node_index=uncomp_node_index)
 
+    # Incremental check, only the edges added above were ordered into the graph.
+    # If one of them closed a cycle, it is the first edge of the returned cycle.
     if return_uncomp_node:
-        return uncomp_node_index, rustworkx.digraph_find_cycle(circuit_graph)
+        return uncomp_node_index, circuit_graph.find_cycle()
 
     else:
-        return rustworkx.digraph_find_cycle(circuit_graph)
-
-def add_uncomputation(circuit_graph: rustworkx.PyDiGraph, ancillas:List[str], allow_cycle=False):
+        return circuit_graph.find_cycle()
+
+# Stable fingerprint of a circuit graph - node indices and keys, the uncomp flags 
+# and the typed edges - that is the same across processes and runs
+def graph_fingerprint(circuit_graph: CircuitGraph):
+    digest = hashlib.sha1()
+    for idx in circuit_graph.node_indices():
+        node = circuit_graph.get_node_data(idx)
+        digest.update(repr((idx, node.label, node.node_num, node.node_type, node.qubit_type, node.opname, 
+                            node.is_uncomputed, node.uncomp_node_index)).encode())
+    for edge in sorted(circuit_graph.weighted_edge_list()):
+        digest.update(repr(tuple(edge)).encode())
+    return digest.hexdigest()
+
+# Rough sizes used by UncompCache to keep under its memory limit
+CACHE_ENTRY_BYTES = 200
+CACHE_NODE_BYTES = 250
+CACHE_EDGE_BYTES = 150
+
+class UncompCache:
+    '''
+    LRU cache of add_uncomputation results, keyed on the graph_fingerprint of the 
+    computation graph, the ancilla set and allow_cycle. Keeps the cycle verdict and, 
+    if store_graphs, a clone of the uncomp graph. The least recently used entries are 
+    evicted once the estimated size goes over max_bytes.
+    '''
+    def __init__(self, max_bytes:int=64*2**20, store_graphs=True):
+        self.max_bytes = max_bytes
+        self.store_graphs = store_graphs
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(fingerprint, ancillas:List[str], allow_cycle=False):
+        return fingerprint, frozenset(ancillas), allow_cycle
+
+    def get(self, key, need_graph=False):
+        '''
+        The (has_cycle, uncomp graph or None) entry for key, None on a miss. With 
+        need_graph, an entry without a graph is a miss.
+        '''
+        entry = self.entries.get(key)
+        if entry is None or (need_graph and entry[1] is None):
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0], entry[1]
+
+    def put(self, key, has_cycle, uncomp_circuit_graph: CircuitGraph=None):
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[2]
+
+        size = CACHE_ENTRY_BYTES
+        if self.store_graphs and uncomp_circuit_graph is not None:
+            uncomp_circuit_graph = uncomp_circuit_graph.clone()
+            size += CACHE_NODE_BYTES * uncomp_circuit_graph.num_nodes() + CACHE_EDGE_BYTES * uncomp_circuit_graph.num_edges()
+        else:
+            uncomp_circuit_graph = None
+        
+        self.entries[key] = (has_cycle, uncomp_circuit_graph, size)
+        self.size += size
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            _, (_, _, evicted_size) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 
+                'entries': len(self.entries), 'size': self.size}
+
+def add_uncomputation(circuit_graph: CircuitGraph, ancillas:List[str], allow_cycle=False, graph_nodes_reverse:List[int]=None, 
+                      cache:UncompCache=None, fingerprint=None):
     '''
     PLDI's Uncomp implementation
     '''
-    uncomp_circuit_graph = copy.deepcopy(circuit_graph)
-    graph_nodes_reverse = list(rustworkx.topological_sort(copy.deepcopy(circuit_graph)))
+    if cache is not None:
+        if fingerprint is None:
+            fingerprint = graph_fingerprint(circuit_graph)
+        key = UncompCache.key(fingerprint, ancillas, allow_cycle)
+        entry = cache.get(key, need_graph=True)
+        if entry is not None:
+            has_cycle, uncomp_circuit_graph = entry
+            return uncomp_circuit_graph.clone(), has_cycle
+
+    uncomp_circuit_graph = circuit_graph.clone()
+    if graph_nodes_reverse is None:
+        graph_nodes_reverse = get_reverse_topological_order(circuit_graph)
+    # print(graph_nodes_reverse)
+    has_cycle = add_uncomputation_in_place(uncomp_circuit_graph, ancillas, graph_nodes_reverse, allow_cycle)
+
+    if cache is not None:
+        cache.put(key, has_cycle, uncomp_circuit_graph)
+    return uncomp_circuit_graph, has_cycle
+
+# Transitive closure of a computation graph, to predict if uncomputing a set of 
+# ancillas causes a cycle without adding any node to a graph
+class ReachabilityIndex:
+    '''
+    Reachability between the nodes of a computation graph as NumPy packed bitsets, 
+    one row per node. would_cycle replays the uncomp steps on the endpoints of the 
+    would-be uncomp nodes only: their edges to and from the graph, and the edges 
+    between them. Any cycle goes through uncomp nodes, with paths of graph nodes 
+    between them, so there is one iff the uncomp nodes, with an edge wherever one 
+    reaches the other through the graph, have a cycle.
+    '''
+    def __init__(self, circuit_graph: CircuitGraph, graph_nodes_reverse:List[int]=None):
+        self.circuit_graph = circuit_graph
+        if graph_nodes_reverse is None:
+            graph_nodes_reverse = get_reverse_topological_order(circuit_graph)
+        self.node_at = list(circuit_graph.node_indices())
+        self.position = {idx: i for i, idx in enumerate(self.node_at)}
+        
+        # Successors come before their predecessors in the reverse topological order
+        self.closure = numpy.zeros((len(self.position), (len(self.position) + 7) // 8), dtype=numpy.uint8)
+        for idx in graph_nodes_reverse:
+            row = self.closure[self.position[idx]]
+            row |= self.node_bits(idx)
+            for successor_idx in circuit_graph.successor_indices(idx):
+                row |= self.closure[self.position[successor_idx]]
+        
+        self.order = {idx: i for i, idx in enumerate(graph_nodes_reverse)}
+        # Comp nodes of every qubit, last one first
+        self.comp_nodes = collections.defaultdict(list)
+        for idx in graph_nodes_reverse:
+            node = circuit_graph.get_node_data(idx)
+            if node.node_type is COMP:
+                self.comp_nodes[node.label].append(idx)
+
+    def node_bits(self, idx):
+        bits = numpy.zeros(self.closure.shape[1], dtype=numpy.uint8)
+        i = self.position[idx]
+        bits[i >> 3] = 0x80 >> (i & 7)
+        return bits
+
+    def _uncomp_edges(self, comp_nodes:List[int]):
+        '''
+        Edges that the uncomp steps of comp_nodes would add. Graph nodes are their 
+        indices, uncomp nodes their (label, node_num) key.
+        '''
+        comp_nodes = sorted(comp_nodes, key=self.order.get)
+        uncomp_nodes = []
+        target_children = collections.defaultdict(list)
+        control_children = collections.defaultdict(list)
+        edges = []
+        for idx in comp_nodes:
+            node = self.circuit_graph.get_node_data(idx)
+            uncomp_node = (node.label, node.get_nodenum() - 1)
+            uncomp_nodes.append(uncomp_node)
+            existing = set(uncomp_nodes)
+
+            prev_node = (node.label, node.get_nodenum())
+            if prev_node not in existing:
+                prev_node = idx
+            edges.append((prev_node, uncomp_node))
+            target_children[prev_node].append(uncomp_node)
+            into_uncomp_node = {prev_node}
+
+            # ctrl* replaces a control whose uncomp node already exists
+            for control_idx in self.circuit_graph.controls_of(idx):
+                control_node = self.circuit_graph.get_node_data(control_idx)
+                control = (control_node.label, control_node.get_nodenum())
+                if control not in existing:
+                    control = control_idx
+                edges.append((control, uncomp_node))
+                control_children[control].append(uncomp_node)
+                into_uncomp_node.add(control)
+
+                control_targets = target_children[control] + \
+                    ([] if isinstance(control, tuple) else self.circuit_graph.successors_by_type(control, TARGET))
+                edges.extend((uncomp_node, x) for x in control_targets if x not in into_uncomp_node)
+
+            prev_controlled = control_children[prev_node] + \
+                ([] if isinstance(prev_node, tuple) else self.circuit_graph.controlled_by(prev_node))
+            edges.extend((x, uncomp_node) for x in prev_controlled if x not in into_uncomp_node)
+        return uncomp_nodes, edges
+
+    def ancilla_comp_nodes(self, ancilla_set):
+        return list(chain.from_iterable(self.comp_nodes[a] for a in set(ancilla_set)))
+
+    def would_cycle(self, ancilla_set):
+        '''
+        True if add_uncomputation of ancilla_set would cause a cycle.
+        '''
+        return self.would_cycle_nodes(self.ancilla_comp_nodes(ancilla_set))
+
+    def would_cycle_nodes(self, comp_nodes:List[int]):
+        '''
+        True if the uncomp steps of only comp_nodes would cause a cycle, see 
+        add_uncomputation_of_nodes.
+        '''
+        uncomp_nodes, reduced_graph, _, _ = self._reduced_graph(comp_nodes)
+        return len(uncomp_nodes) > 0 and not rustworkx.is_directed_acyclic_graph(reduced_graph)
+
+    def cycle_labels(self, ancilla_set, through_graph=False):
+        '''
+        Labels of the uncomp nodes on one cycle that add_uncomputation of ancilla_set 
+        would cause, empty if there is none. With through_graph, also the labels of 
+        the graph nodes on the cycle, along one graph path between each two 
+        consecutive uncomp nodes.
+        '''
+        uncomp_nodes, reduced_graph, children, parents = self._reduced_graph(self.ancilla_comp_nodes(ancilla_set))
+        if rustworkx.is_directed_acyclic_graph(reduced_graph):
+            return set()
+
+        # The uncomp nodes are in the order add_uncomputation adds them, each one only
+        # adds edges to and from the ones before it. The first cycle it closes is in the
+        # shortest cyclic prefix and goes through its last node.
+        low, high = 1, len(uncomp_nodes)
+        while low < high:
+            mid = (low + high) // 2
+            if rustworkx.is_directed_acyclic_graph(reduced_graph.subgraph(list(range(mid)))):
+                low = mid + 1
+            else:
+                high = mid
+        reduced_graph = reduced_graph.subgraph(list(range(low)))
+        cycle = rustworkx.digraph_find_cycle(reduced_graph, low - 1)
+        labels = {uncomp_nodes[i][0] for edge in cycle for i in edge}
+        if not through_graph:
+            return labels
+
+        for i, j in cycle:
+            # Edges through the graph carry True, direct ones between uncomp nodes None
+            if reduced_graph.get_edge_data(i, j) is None:
+                continue
+            columns = numpy.array(parents[j])
+            masks = (0x80 >> (columns & 7)).astype(numpy.uint8)
+            reaches_parent = lambda x: (self.closure[x, columns >> 3] & masks).any()
+            # Walk down from a graph child of i, staying on nodes that reach a parent of j
+            x = next(c for c in children[i] if reaches_parent(c))
+            while True:
+                labels.add(self.circuit_graph.get_node_data(self.node_at[x]).label)
+                if x in parents[j]:
+                    break
+                x = next(self.position[s] for s in self.circuit_graph.successor_indices(self.node_at[x]) 
+                         if reaches_parent(self.position[s]))
+        return labels
+
+    def _reduced_graph(self, comp_nodes:List[int]):
+        '''
+        The would-be uncomp nodes of comp_nodes, and a rustworkx.PyDiGraph over them 
+        with an edge wherever one reaches the other. Also the positions of the graph 
+        children and graph parents of every uncomp node.
+        '''
+        uncomp_nodes, edges = self._uncomp_edges(comp_nodes)
+        
+        uncomp_pos = {u: i for i, u in enumerate(uncomp_nodes)}
+        children = [[] for _ in uncomp_nodes]
+        parents = [[] for _ in uncomp_nodes]
+        direct = set()
+        for parent, child in edges:
+            if isinstance(parent, tuple) and isinstance(child, tuple):
+                direct.add((uncomp_pos[parent], uncomp_pos[child]))
+            elif isinstance(parent, tuple):
+                children[uncomp_pos[parent]].append(self.position[child])
+            elif isinstance(child, tuple):
+                parents[uncomp_pos[child]].append(self.position[parent])
+
+        reaches = numpy.zeros((len(uncomp_nodes), self.closure.shape[1]), dtype=numpy.uint8)
+        for i, positions in enumerate(children):
+            if len(positions):
+                reaches[i] = numpy.bitwise_or.reduce(self.closure[positions], axis=0)
+
+        # Uncomp node i reaches j through the graph if it reaches a graph parent of j, 
+        # an uncomp node reaching itself is a self loop
+        columns = numpy.array([p for positions in parents for p in positions], dtype=numpy.int64)
+        targets = numpy.repeat(numpy.arange(len(parents)), [len(positions) for positions in parents])
+        reached = reaches[:, columns >> 3] & (0x80 >> (columns & 7)).astype(numpy.uint8)
+        sources, pairs = numpy.nonzero(reached)
+        through_graph = set(zip(sources.tolist(), targets[pairs].tolist())) - direct
+
+        reduced_graph = rustworkx.PyDiGraph()
+        reduced_graph.add_nodes_from(uncomp_nodes)
+        reduced_graph.add_edges_from_no_data(list(direct))
+        reduced_graph.add_edges_from([(i, j, True) for i, j in through_graph])
+        return uncomp_nodes, reduced_graph, children, parents
+
+    def conflicting_ancillas(self, ancilla, ancillas:List[str]=None):
+        '''
+        The ancillas that cause a cycle when uncomputed together with ancilla, all of 
+        them if ancilla causes one by itself. ancillas defaults to every qubit with a 
+        comp node.
+        '''
+        if ancillas is None:
+            ancillas = list(self.comp_nodes)
+        return [a for a in ancillas if a != ancilla and self.would_cycle([ancilla, a])]
+
+# Which comp nodes get an uncomp node, decided without touching a graph. Strategies 
+# can search over plans and build the uncomp graph once, for the plan they choose.
+class UncompPlan:
+    '''
+    Set of (label, node_num) keys of the comp nodes that get an uncomp node. 
+    materialize() builds the uncomp graph of the plan, with the uncomp steps in the 
+    reverse topological order of the computation graph as add_uncomputation does.
+    '''
+    __slots__ = ('comp_nodes',)
+
+    def __init__(self, comp_nodes=()):
+        self.comp_nodes = frozenset(comp_nodes)
+
+    @classmethod
+    def from_ancillas(cls, circuit_graph: CircuitGraph, ancillas:List[str]):
+        return cls((a, circuit_graph.get_node_data(idx).get_nodenum()) 
+                   for a in set(ancillas) for idx in circuit_graph.wire_nodes(a, COMP))
+
+    @classmethod
+    def from_cuts(cls, circuit_graph: CircuitGraph, cuts:Dict[str, int]):
+        '''
+        Plan of the last cuts[a] comp nodes of every ancilla a, see exact_uncomputation_partial.
+        '''
+        comp_nodes = []
+        for a, cut in cuts.items():
+            node_nums = sorted((circuit_graph.get_node_data(idx).get_nodenum() for idx in circuit_graph.wire_nodes(a, COMP)), 
+                               reverse=True)
+            comp_nodes.extend((a, node_num) for node_num in node_nums[:cut])
+        return cls(comp_nodes)
+
+    @classmethod
+    def from_uncomp_graph(cls, uncomp_circuit_graph: CircuitGraph):
+        '''
+        Plan of the comp nodes uncomputed in a graph. A graph that had uncomp removed 
+        may differ from the one its plan materializes to.
+        '''
+        return cls((node.label, node.get_nodenum()) for node in uncomp_circuit_graph.nodes() 
+                   if node.node_type is COMP and node.is_uncomputed)
+
+    def __len__(self):
+        return len(self.comp_nodes)
+
+    def __or__(self, other):
+        return UncompPlan(self.comp_nodes | other.comp_nodes)
+
+    def __eq__(self, other):
+        return isinstance(other, UncompPlan) and self.comp_nodes == other.comp_nodes
+
+    def __hash__(self):
+        return hash(self.comp_nodes)
+
+    def __repr__(self):
+        return f'UncompPlan({sorted(self.comp_nodes)})'
+
+    def ancillas(self):
+        return sorted({label for label, node_num in self.comp_nodes})
+
+    def node_indices(self, circuit_graph: CircuitGraph):
+        return [circuit_graph.find_node(label, node_num, COMP) for label, node_num in self.comp_nodes]
+
+    def would_cycle(self, reachability_index: ReachabilityIndex):
+        return reachability_index.would_cycle_nodes(self.node_indices(reachability_index.circuit_graph))
+
+    def materialize(self, circuit_graph: CircuitGraph, graph_nodes_reverse:List[int]=None, allow_cycle=False):
+        '''
+        The uncomp graph of the plan and whether it has a cycle.
+        '''
+        return add_uncomputation_of_nodes(circuit_graph, self.node_indices(circuit_graph), graph_nodes_reverse, allow_cycle)
+
+    def uncomp_circuit(self, circuit_graph: CircuitGraph, graph_nodes_reverse:List[int]=None):
+        uncomp_circuit_graph, has_cycle = self.materialize(circuit_graph, graph_nodes_reverse)
+        if has_cycle:
+            raise ValueError(f'{self} causes a cycle in the uncomp graph')
+        return get_uncomp_circuit(uncomp_circuit_graph)
+
+# Only the cycle verdict of add_uncomputation, which the cache or a ReachabilityIndex 
+# of circuit_graph can answer without a graph
+def uncomputation_has_cycle(circuit_graph: CircuitGraph, ancillas:List[str], graph_nodes_reverse:List[int]=None, 
+                            cache:UncompCache=None, fingerprint=None, reachability_index:ReachabilityIndex=None):
+    if cache is None:
+        if reachability_index is not None:
+            return reachability_index.would_cycle(ancillas)
+        return add_uncomputation(circuit_graph, ancillas, graph_nodes_reverse=graph_nodes_reverse)[1]
+    
+    if fingerprint is None:
+        fingerprint = graph_fingerprint(circuit_graph)
+    key = UncompCache.key(fingerprint, ancillas)
+    entry = cache.get(key)
+    if entry is not None:
+        return entry[0]
+
+    if reachability_index is not None:
+        has_cycle = reachability_index.would_cycle(ancillas)
+        cache.put(key, has_cycle)
+        return has_cycle
+
+    uncomp_circuit_graph, has_cycle = add_uncomputation(circuit_graph, ancillas, graph_nodes_reverse=graph_nodes_reverse)
+    cache.put(key, has_cycle, uncomp_circuit_graph)
+    return has_cycle
+
+def get_reverse_topological_order(circuit_graph: CircuitGraph):
+    graph_nodes_reverse = list(rustworkx.topological_sort(circuit_graph))
     # Reverse the graph nodes, to add uncomp. 
     graph_nodes_reverse.reverse()
-    # print(graph_nodes_reverse)
+    return graph_nodes_reverse
+
+# Uncomp graph of all ancillas with cycles, the starting point of the greedy strategies.
+# A graph that was already built is cloned instead.
+def get_full_uncomp_graph(circuit_graph: CircuitGraph, ancillas:List[str], full_uncomp_graph: CircuitGraph=None, 
+                          cache:UncompCache=None):
+    if full_uncomp_graph is not None:
+        return full_uncomp_graph.clone()
+    uncomp_circuit_graph, has_cycle = add_uncomputation(circuit_graph, ancillas, allow_cycle=True, cache=cache)
+    return uncomp_circuit_graph
+
+def add_uncomputation_in_place(uncomp_circuit_graph: CircuitGraph, ancillas:List[str], graph_nodes_reverse:List[int], allow_cycle=False):
+    '''
+    Uncomp steps for the comp nodes of the ancillas, in the given (reverse topological) 
+    order of the computation graph. Returns whether a cycle was created.
+    '''
     for idx in graph_nodes_reverse:
-        if circuit_graph.get_node_data(idx).label in ancillas and circuit_graph.get_node_data(idx).node_type is COMP:
+        node = uncomp_circuit_graph.get_node_data(idx)
+        if node.label in ancillas and node.node_type is COMP:
             cycle = add_uncomputation_step(uncomp_circuit_graph, idx)
 
             if not allow_cycle and len(cycle) > 0:
@@ -160,21 +554,121 @@ def add_uncomputation(circuit_graph: rustworkx.PyDiGraph, ancillas:List[str], al
                 # for id in cycle:
                 #     print(uncomp_circuit_graph.get_node_data(id[0]).graph_label(), uncomp_circuit_graph.get_node_data(id[1]).graph_label(), sep=' --> ')
 
-                return uncomp_circuit_graph, True
+                return True
+
+    return False
 
-    return uncomp_circuit_graph, False
+# Uncomp of only some comp nodes, e.g. the last nodes of each ancilla for partial uncomp
+def add_uncomputation_of_nodes(circuit_graph: CircuitGraph, comp_nodes:List[int], graph_nodes_reverse:List[int]=None, allow_cycle=False):
+    '''
+    Uncomp steps for the given comp nodes, in the reverse topological order of the 
+    computation graph. Returns the uncomp graph and whether it has a cycle.
+    '''
+    uncomp_circuit_graph = circuit_graph.clone()
+    if graph_nodes_reverse is None:
+        graph_nodes_reverse = get_reverse_topological_order(circuit_graph)
+    comp_nodes = set(comp_nodes)
+    for idx in graph_nodes_reverse:
+        if idx in comp_nodes:
+            cycle = add_uncomputation_step(uncomp_circuit_graph, idx)
+            if not allow_cycle and len(cycle) > 0:
+                return uncomp_circuit_graph, True
+    return uncomp_circuit_graph, len(uncomp_circuit_graph.find_cycle()) > 0
+
+# Wall clock deadline for a time budget in seconds, None for no budget
+def get_deadline(time_budget:float=None):
+    if time_budget is None:
+        return None
+    return time.time() + time_budget
+
+def deadline_passed(deadline:float=None):
+    return deadline is not None and time.time() >= deadline
+
+# Sampling time of the 'sampled' greedy metric, cut down to what is left before the deadline
+def remaining_sample_time(sample_time:float, deadline:float=None):
+    if deadline is None:
+        return sample_time
+    return max(0.0, min(sample_time, deadline - time.time()))
+
+def exhaustive_uncomputation(circuit_graph: CircuitGraph, ancillas:List[str], return_uncomputed_ancillas=False, 
+                             search:Literal['pruned', 'gray', 'parallel', 'adding', 'conflict']='pruned', max_workers=None, 
+                             time_budget:float=None, graph_nodes_reverse:List[int]=None, full_uncomp_graph: CircuitGraph=None, 
+                             cache:UncompCache=None, materialize=True, core_search:Literal['pruned', 'milp']='pruned'):
+    '''
+    With a time_budget in seconds, a greedy set is found first, within a quarter of the 
+    budget, and kept if the search runs out of time. The result then ends with a flag, 
+    True if the set is optimal.
+    All searches get their verdicts from one ReachabilityIndex, and the uncomp graph 
+    is only built for the set they return. A cache keeps the verdicts of the 'gray' 
+    and 'adding' searches and the final graph between calls.
+    Without materialize, an UncompPlan is returned in place of the uncomp graph.
+    core_search is how the 'conflict' search solves the ancillas with conflicts.
+    '''
+    deadline = get_deadline(time_budget)
+    if graph_nodes_reverse is None:
+        graph_nodes_reverse = get_reverse_topological_order(circuit_graph)
+    reachability_index = ReachabilityIndex(circuit_graph, graph_nodes_reverse)
+    fingerprint = graph_fingerprint(circuit_graph) if cache is not None else None
+    if deadline is not None:
+        # The greedy incumbent gets at most a quarter of the budget, the search gets 
+        # what is left of it, both counted from the same deadline
+        incumbent_budget = max(0.0, min(time_budget / 4, deadline - time.time()))
+        _, incumbent_set, _ = greedy_uncomputation_full(circuit_graph, ancillas, return_uncomputed_ancillas=True, 
+                                                        metric='scc', time_budget=incumbent_budget, 
+                                                        full_uncomp_graph=full_uncomp_graph, cache=cache)
 
-def exhaustive_uncomputation(circuit_graph: rustworkx.PyDiGraph, ancillas:List[str], return_uncomputed_ancillas=False):
-    largest_set = exhaustive_uncomputation_adding(circuit_graph, ancillas)
-    uncomp_graph, has_cycle = add_uncomputation(circuit_graph, largest_set)
+    try:
+        if search == 'pruned':
+            largest_set = exhaustive_uncomputation_pruned(circuit_graph, ancillas, deadline, graph_nodes_reverse, 
+                                                          reachability_index=reachability_index)
+        elif search == 'gray':
+            largest_set = exhaustive_uncomputation_gray(circuit_graph, ancillas, deadline, graph_nodes_reverse, cache, fingerprint, 
+                                                        reachability_index)
+        elif search == 'parallel':
+            largest_set = exhaustive_uncomputation_parallel(circuit_graph, ancillas, max_workers=max_workers, deadline=deadline, 
+                                                            graph_nodes_reverse=graph_nodes_reverse, 
+                                                            reachability_index=reachability_index)
+        elif search == 'adding':
+            largest_set = exhaustive_uncomputation_adding(circuit_graph, ancillas, deadline, graph_nodes_reverse, cache, fingerprint, 
+                                                          reachability_index)
+        elif search == 'conflict':
+            largest_set = exhaustive_uncomputation_conflict(circuit_graph, ancillas, deadline, graph_nodes_reverse, 
+                                                            core_search, reachability_index)
+        else:
+            raise ValueError(f'Unknown exhaustive search {search}')
+        is_optimal = True
+    except TimeoutError:
+        logger.info(f'Exhaustive search ran out of time, keeping greedy set {incumbent_set}')
+        largest_set = tuple(incumbent_set)
+        is_optimal = False
+
+    if materialize:
+        uncomp_graph, has_cycle = add_uncomputation(circuit_graph, largest_set, graph_nodes_reverse=graph_nodes_reverse, 
+                                                    cache=cache, fingerprint=fingerprint)
+    else:
+        uncomp_graph = UncompPlan.from_ancillas(circuit_graph, largest_set)
+        has_cycle = not is_optimal and uncomp_graph.would_cycle(reachability_index)
+    if has_cycle and not is_optimal:
+        # The greedy set was found by removing uncomp, building it from scratch can differ
+        largest_set = ()
+        if materialize:
+            uncomp_graph, has_cycle = add_uncomputation(circuit_graph, largest_set, graph_nodes_reverse=graph_nodes_reverse)
+        else:
+            uncomp_graph, has_cycle = UncompPlan(), False
     if has_cycle:
         raise ValueError(f'Largest Set of Ancillas {largest_set} still causes cycles in uncomp graph')
-    if return_uncomputed_ancillas:
+
+    if return_uncomputed_ancillas and deadline is not None:
+        return uncomp_graph, largest_set, is_optimal
+    elif return_uncomputed_ancillas:
         return uncomp_graph, largest_set
+    elif deadline is not None:
+        return uncomp_graph, is_optimal
     else:
         return uncomp_graph  
 
-def exhaustive_uncomputation_adding(circuit_graph: rustworkx.PyDiGraph, ancillas:List[str]):
+def exhaustive_uncomputation_adding(circuit_graph: CircuitGraph, ancillas:List[str], deadline:float=None, graph_nodes_reverse:List[int]=None, 
+                                    cache:UncompCache=None, fingerprint=None, reachability_index:ReachabilityIndex=None):
     '''
     Exhaustively iterate over adding uncomputation for all possible ancillas
     '''
@@ -186,48 +680,413 @@ def exhaustive_uncomputation_adding(circuit_graph: rustworkx.PyDiGraph, ancillas
         # uncomp_circuit_graph = copy.deepcopy(circuit_graph)
         # print(f'Adding Uncomputation for ancilla set {ancilla_set}')
         # logger.info(f'Adding Uncomputation for ancilla set {ancilla_set}')
-        uncomp_circuit_graph, has_cycle = add_uncomputation(circuit_graph, list(ancilla_set))
+        if deadline_passed(deadline):
+            raise TimeoutError('Exhaustive uncomp ran out of time')
+        has_cycle = uncomputation_has_cycle(circuit_graph, list(ancilla_set), graph_nodes_reverse, cache, fingerprint, 
+                                            reachability_index)
         
         if not has_cycle and len(ancilla_set) > len(largest_uncomputable):
             largest_uncomputable = ancilla_set
 
     return largest_uncomputable
 
-def exhaustive_uncomputation_adding_reverse(circuit_graph: rustworkx.PyDiGraph, ancillas:List[str]):
+def get_cyclic_ancilla_core(circuit_graph: CircuitGraph, ancilla_set, reachability_index:ReachabilityIndex=None, 
+                            graph_nodes_reverse:List[int]=None):
     '''
-    Exhaustively iterate over adding uncomputation for all possible ancillas
+    Shrink a cyclic ancilla set to the ancillas whose uncomp nodes lie on a cycle 
+    it causes, as long as that smaller set is still cyclic. Empty for an acyclic set. 
+    Cycles are found on the reachability index, without building an uncomp graph.
     '''
+    if reachability_index is None:
+        reachability_index = ReachabilityIndex(circuit_graph, graph_nodes_reverse)
+    cycle_labels = reachability_index.cycle_labels(ancilla_set)
+    if len(cycle_labels) == 0:
+        return ()
+    core = tuple(ancilla_set)
+    while True:
+        smaller_core = tuple(a for a in core if a in cycle_labels)
+        if len(smaller_core) == len(core) or len(smaller_core) == 0:
+            return core
+        
+        cycle_labels = reachability_index.cycle_labels(smaller_core)
+        if len(cycle_labels) == 0:
+            return core
+        core = smaller_core
+
+def get_ancilla_influencers(circuit_graph: CircuitGraph, ancillas:List[str]):
+    '''
+    For every ancilla, the other ancillas that control one of its gates. Their uncomp 
+    nodes replace those controls (ctrl*), which can remove edges of its uncomp nodes.
+    '''
+    influencers = {a: set() for a in ancillas}
+    for idx in circuit_graph.node_indices():
+        node = circuit_graph.get_node_data(idx)
+        if node.label in influencers and node.node_type is COMP:
+            for control_idx in circuit_graph.controls_of(idx):
+                control_label = circuit_graph.get_node_data(control_idx).label
+                if control_label in influencers and control_label != node.label:
+                    influencers[node.label].add(control_label)
+    return influencers
+
+def get_cycle_influencers(circuit_graph: CircuitGraph, cyclic_set, influencers, graph_nodes_reverse:List[int]=None, 
+                          reachability_index:ReachabilityIndex=None):
+    '''
+    Influencers of a cyclic ancilla set with a node on the cycle it causes, see 
+    ReachabilityIndex.cycle_labels. Only their ctrl* can remove an edge of that 
+    cycle, so every superset that adds none of them is cyclic as well.
+    '''
+    if reachability_index is None:
+        reachability_index = ReachabilityIndex(circuit_graph, graph_nodes_reverse)
+    on_cycle = reachability_index.cycle_labels(cyclic_set, through_graph=True)
+    return {b for a in cyclic_set for b in influencers[a] if b in on_cycle and b not in cyclic_set}
+
+def get_cyclic_ancilla_cores(circuit_graph: CircuitGraph, ancilla_set, influencers, reachability_index:ReachabilityIndex):
+    '''
+    Cyclic cores of an ancilla set, each with its cycle influencers, empty for an 
+    acyclic set. A core does not rule out the set if the set uncomputes one of its 
+    influencers, so the core grows by those until none is left, and ends at the 
+    whole set once the grown core is acyclic. The last core always rules out the set.
+    '''
+    core = get_cyclic_ancilla_core(circuit_graph, ancilla_set, reachability_index)
+    cores = []
+    while len(core):
+        cycle_influencers = get_cycle_influencers(circuit_graph, core, influencers, reachability_index=reachability_index)
+        cores.append((core, cycle_influencers))
+        added = [b for b in cycle_influencers if b in ancilla_set]
+        if len(added) == 0:
+            break
+        core = tuple(a for a in ancilla_set if a in core or a in added)
+        if len(core) == len(ancilla_set) or not reachability_index.would_cycle(core):
+            core = tuple(ancilla_set)
+            cores.append((core, get_cycle_influencers(circuit_graph, core, influencers, reachability_index=reachability_index)))
+            break
+    return cores
+
+def get_infeasible_ancillas(circuit_graph: CircuitGraph, ancillas:List[str], influencers=None, graph_nodes_reverse:List[int]=None, 
+                            reachability_index:ReachabilityIndex=None):
+    '''
+    Ancillas that are in no acyclic set: cyclic on their own, and every influencer 
+    on that cycle is infeasible as well.
+    '''
+    if influencers is None:
+        influencers = get_ancilla_influencers(circuit_graph, ancillas)
+    if reachability_index is None:
+        reachability_index = ReachabilityIndex(circuit_graph, graph_nodes_reverse)
+    cycle_influencers = {a: get_cycle_influencers(circuit_graph, [a], influencers, reachability_index=reachability_index) 
+                         for a in ancillas if reachability_index.would_cycle([a])}
     
-    # ancillas = list(range(num_qubit, num_qubit+num_ancilla))
-    ancillas_power_set = list(chain.from_iterable(combinations(ancillas, r) for r in range(len(ancillas)+1)))
-    # ancillas_power_set = 
-    ancillas_power_set.reverse()
-    # print(ancillas_power_set)
+    infeasible = set()
+    changed = True
+    while changed:
+        changed = False
+        for a, cycle_influencer_set in cycle_influencers.items():
+            if a not in infeasible and cycle_influencer_set <= infeasible:
+                infeasible.add(a)
+                changed = True
+    return [a for a in ancillas if a in infeasible]
+
+def exhaustive_uncomputation_pruned(circuit_graph: CircuitGraph, ancillas:List[str], deadline:float=None, graph_nodes_reverse:List[int]=None, 
+                                    cyclic_sets:List[tuple]=None, reachability_index:ReachabilityIndex=None):
+    '''
+    Search the ancilla subsets from the largest down, skipping the supersets of a 
+    set already known to cause a cycle. Uncomputing more ancillas only adds nodes 
+    and edges, unless an added ancilla controls a gate of the cyclic set and its 
+    uncomp nodes replace those controls. So a superset is skipped only if it adds 
+    none of the influencers on the cycle. Returns the same set as 
+    exhaustive_uncomputation_adding, and raises TimeoutError if the deadline passes 
+    first. cyclic_sets are ancilla sets already known to be cyclic. Sets, their cores 
+    and cycle influencers are all found on the reachability index, no uncomp graph 
+    is built.
+    '''
+    ancillas = list(ancillas)
+    # Each ancilla is a bit, cyclic cores and their influencers are kept as bitmasks
+    ancilla_bits = {a: 1 << i for i, a in enumerate(ancillas)}
+    influencers = get_ancilla_influencers(circuit_graph, ancillas)
+    if graph_nodes_reverse is None:
+        graph_nodes_reverse = get_reverse_topological_order(circuit_graph)
+    if reachability_index is None:
+        reachability_index = ReachabilityIndex(circuit_graph, graph_nodes_reverse)
+    def core_masks(core, cycle_influencers):
+        return sum(ancilla_bits[a] for a in core), sum(ancilla_bits[b] for b in cycle_influencers)
+
+    cyclic_cores = [core_masks(cyclic_set, get_cycle_influencers(circuit_graph, cyclic_set, influencers, 
+                                                                 reachability_index=reachability_index)) 
+                    for cyclic_set in cyclic_sets or [] if all(a in ancilla_bits for a in cyclic_set)]
+
+    for r in range(len(ancillas), 0, -1):
+        for ancilla_set in combinations(ancillas, r):
+            mask = sum(ancilla_bits[a] for a in ancilla_set)
+            if any(mask & core == core and mask & core_influencers == 0 for core, core_influencers in cyclic_cores):
+                continue
+            if deadline_passed(deadline):
+                raise TimeoutError('Exhaustive uncomp ran out of time')
+            
+            cores = get_cyclic_ancilla_cores(circuit_graph, ancilla_set, influencers, reachability_index)
+            if len(cores) == 0:
+                return ancilla_set
+            for core, cycle_influencers in cores:
+                logger.info(f'Ancillas {core} cause a cycle, skipping their supersets')
+                cyclic_cores.append(core_masks(core, cycle_influencers))
 
+    return ()
+
+def ancilla_conflict_graph(circuit_graph: CircuitGraph, ancillas:List[str], graph_nodes_reverse:List[int]=None, 
+                           deadline:float=None, reachability_index:ReachabilityIndex=None):
+    '''
+    Check every single ancilla and every pair of ancillas for cycles on the 
+    reachability index. Returns the infeasible ancillas, see get_infeasible_ancillas, 
+    and a rustworkx.PyGraph of the others with a self loop for each ancilla cyclic 
+    on its own and an edge between every other pair that is cyclic together. 
+    Raises TimeoutError if the deadline passes first.
+    '''
+    ancillas = list(ancillas)
+    if reachability_index is None:
+        reachability_index = ReachabilityIndex(circuit_graph, graph_nodes_reverse)
+
+    cyclic = {a for a in ancillas if reachability_index.would_cycle([a])}
+    infeasible = get_infeasible_ancillas(circuit_graph, ancillas, reachability_index=reachability_index) if len(cyclic) else []
+    
+    conflict_graph = rustworkx.PyGraph()
+    node_of = {a: conflict_graph.add_node(a) for a in ancillas if a not in infeasible}
+    for a in cyclic.intersection(node_of):
+        conflict_graph.add_edge(node_of[a], node_of[a], None)
+    for a, b in combinations([a for a in node_of if a not in cyclic], 2):
+        if deadline_passed(deadline):
+            raise TimeoutError('Conflict graph ran out of time')
+        if reachability_index.would_cycle([a, b]):
+            conflict_graph.add_edge(node_of[a], node_of[b], None)
+    
+    logger.info(f'Conflict graph: {len(infeasible)} infeasible ancillas, {conflict_graph.num_edges()} cyclic singles and pairs')
+    return infeasible, conflict_graph
+
+def exhaustive_uncomputation_conflict(circuit_graph: CircuitGraph, ancillas:List[str], deadline:float=None, 
+                                      graph_nodes_reverse:List[int]=None, core_search:Literal['pruned', 'milp']='pruned', 
+                                      reachability_index:ReachabilityIndex=None):
+    '''
+    Search only over the ancillas with a conflict, and add the ones without directly. 
+    An ancilla is conflict free if it is in no cyclic single or pair and controls no 
+    gate of an ancilla with a conflict, so it can not break a cycle among them. If the 
+    combined set is cyclic, a cycle needs three or more ancillas and all feasible 
+    ancillas are searched. The size is optimal, ties between sets of the same size 
+    may be broken differently than exhaustive_uncomputation_adding. Raises 
+    TimeoutError if the deadline passes first, a MILP core search is not 
+    interrupted once started.
+    '''
+    ancillas = list(ancillas)
+    if graph_nodes_reverse is None:
+        graph_nodes_reverse = get_reverse_topological_order(circuit_graph)
+    if reachability_index is None:
+        reachability_index = ReachabilityIndex(circuit_graph, graph_nodes_reverse)
+    
+    infeasible, conflict_graph = ancilla_conflict_graph(circuit_graph, ancillas, graph_nodes_reverse, deadline, reachability_index)
+    feasible = [a for a in ancillas if a not in infeasible]
+    cyclic_sets = [tuple(dict.fromkeys((conflict_graph[u], conflict_graph[v]))) for u, v in conflict_graph.edge_list()]
+    
+    influencers = get_ancilla_influencers(circuit_graph, feasible)
+    in_conflict = {a for cyclic_set in cyclic_sets for a in cyclic_set}
+    while True:
+        added = {b for a in in_conflict for b in influencers[a]} - in_conflict
+        if len(added) == 0:
+            break
+        in_conflict |= added
+    core = [a for a in feasible if a in in_conflict]
+
+    def search(search_ancillas):
+        if deadline_passed(deadline):
+            raise TimeoutError('Exhaustive uncomp ran out of time')
+        if core_search == 'milp':
+            return milp_uncomputation(circuit_graph, search_ancillas, return_uncomputed_ancillas=True, 
+                                      graph_nodes_reverse=graph_nodes_reverse, cyclic_sets=cyclic_sets, 
+                                      reachability_index=reachability_index)[1]
+        return exhaustive_uncomputation_pruned(circuit_graph, search_ancillas, deadline, graph_nodes_reverse, cyclic_sets, 
+                                               reachability_index)
+
+    logger.info(f'Searching {len(core)} ancillas with conflicts, adding {len(feasible) - len(core)} directly')
+    core_set = search(core) if len(core) else ()
+    largest_set = tuple(a for a in feasible if a in core_set or a not in in_conflict)
+    if not reachability_index.would_cycle(largest_set):
+        return largest_set
+
+    logger.info(f'Ancillas {largest_set} cause a cycle of more than two ancillas, searching all feasible ancillas')
+    return search(feasible)
+
+def exhaustive_uncomputation_gray(circuit_graph: CircuitGraph, ancillas:List[str], deadline:float=None, graph_nodes_reverse:List[int]=None, 
+                                  cache:UncompCache=None, fingerprint=None, reachability_index:ReachabilityIndex=None):
+    '''
+    Exhaustively iterate over all ancilla sets in Gray code order. Consecutive sets 
+    differ by one ancilla, so only that ancilla's uncomp nodes are added to or 
+    removed from a single working graph. Sets that are acyclic in the working 
+    graph and would be the new best are checked again with add_uncomputation, and 
+    so are cyclic ones if an ancilla of the set controls a gate of another one.
+    Returns the largest acyclic set, the first one in combinations order on ties.
+    '''
+    ancillas = list(ancillas)
+    uncomp_circuit_graph = circuit_graph.clone()
+
+    # Comp nodes of each ancilla, in the order add_uncomputation would visit them
+    if graph_nodes_reverse is None:
+        graph_nodes_reverse = get_reverse_topological_order(circuit_graph)
+    ancilla_comp_nodes = {a: [] for a in ancillas}
+    for idx in graph_nodes_reverse:
+        node = circuit_graph.get_node_data(idx)
+        if node.label in ancilla_comp_nodes and node.node_type is COMP:
+            ancilla_comp_nodes[node.label].append(idx)
+    
+    # Ancillas controlling a gate of each ancilla, as bitmasks
+    influencers = get_ancilla_influencers(circuit_graph, ancillas)
+    influencer_masks = [sum(1 << ancillas.index(b) for b in influencers[a]) for a in ancillas]
+
+    uncomputed = [False] * len(ancillas)
+    mask = 0
     largest_uncomputable = ()
-    # ctr = 0
-    for ancilla_set in tqdm(ancillas_power_set, desc='Checking Out Exhaustive Uncomp for All Ancillas'):
+    for i in tqdm(range(1, 2**len(ancillas)), desc='Checking Out Gray Code Uncomp for All Ancillas'):
+        if deadline_passed(deadline):
+            raise TimeoutError('Exhaustive uncomp ran out of time')
+        # Position of the bit flipped between Gray codes i-1 and i
+        bit = (i & -i).bit_length() - 1
+        ancilla = ancillas[bit]
+
+        if uncomputed[bit]:
+            for idx in reversed(ancilla_comp_nodes[ancilla]):
+                node = uncomp_circuit_graph.get_node_data(idx)
+                remove_uncomputation_step(uncomp_circuit_graph, node.uncomp_node_index)
+                uncomp_circuit_graph.set_node_flags(idx, is_uncomputed=False, uncomp_node_index=-1)
+        else:
+            for idx in ancilla_comp_nodes[ancilla]:
+                add_uncomputation_step(uncomp_circuit_graph, idx)
+        uncomputed[bit] = not uncomputed[bit]
+        mask ^= 1 << bit
+
+        # Without ctrl* between the ancillas of the set, the order they were added 
+        # in does not matter and a cycle in the working graph is a cycle from scratch
+        if len(uncomp_circuit_graph.find_cycle()) > 0 and \
+            not any(mask & influencer_masks[j] for j, u in enumerate(uncomputed) if u):
+            continue
+
+        ancilla_set = tuple(a for a, u in zip(ancillas, uncomputed) if u)
+        if len(ancilla_set) < len(largest_uncomputable):
+            continue
+        # Same order as combinations(), which compares positions lexicographically
+        positions = [j for j, u in enumerate(uncomputed) if u]
+        if len(ancilla_set) == len(largest_uncomputable) and \
+            positions > [ancillas.index(a) for a in largest_uncomputable]:
+            continue
+
+        # The working graph added the ancillas in Gray code order, not in the 
+        # topological order add_uncomputation uses, and the ctrl* controls can 
+        # differ between the two. Confirm a new best set from scratch.
+        has_cycle = uncomputation_has_cycle(circuit_graph, list(ancilla_set), graph_nodes_reverse, cache, fingerprint, 
+                                            reachability_index)
+        if not has_cycle:
+            largest_uncomputable = ancilla_set
+
+    return largest_uncomputable
+
+# Set once in every worker process of exhaustive_uncomputation_parallel
+_worker_reachability_index = None
+_worker_ancillas = None
+_worker_best_size = None
+
+def _init_exhaustive_worker(reachability_index: ReachabilityIndex, ancillas:List[str], best_size):
+    global _worker_reachability_index, _worker_ancillas, _worker_best_size
+    _worker_reachability_index = reachability_index
+    _worker_ancillas = ancillas
+    _worker_best_size = best_size
+
+def _exhaustive_shard(r, first, deadline=None):
+    '''
+    Check the ancilla sets of size r starting with ancilla number first, in 
+    combinations order. Returns the first acyclic one, or None. 
+    '''
+    first_ancilla = _worker_ancillas[first]
+    for rest in combinations(_worker_ancillas[first+1:], r-1):
+        # Another shard already found a larger set
+        if _worker_best_size.value > r:
+            return None
+        if deadline_passed(deadline):
+            raise TimeoutError('Exhaustive uncomp ran out of time')
+
+        ancilla_set = (first_ancilla,) + rest
+        if not _worker_reachability_index.would_cycle(ancilla_set):
+            with _worker_best_size.get_lock():
+                _worker_best_size.value = max(_worker_best_size.value, r)
+            return ancilla_set
+
+    return None
+
+def exhaustive_uncomputation_parallel(circuit_graph: CircuitGraph, ancillas:List[str], max_workers=None, deadline:float=None, 
+                                      graph_nodes_reverse:List[int]=None, reachability_index:ReachabilityIndex=None):
+    '''
+    Exhaustive uncomp over a process pool. Sets are split into shards by size and 
+    first ancilla, the reachability index is sent to each worker once, and workers 
+    give up on shards smaller than the largest acyclic set found so far. 
+    Returns the same set as exhaustive_uncomputation_adding.
+    '''
+    ancillas = list(ancillas)
+    n = len(ancillas)
+    if reachability_index is None:
+        reachability_index = ReachabilityIndex(circuit_graph, graph_nodes_reverse)
+    best_size = multiprocessing.Value('i', 0)
+    # Largest sets first, so small shards can be dropped early
+    shards = [(r, first) for r in range(n, 0, -1) for first in range(n - r + 1)]
+
+    found = []
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_exhaustive_worker, 
+                             initargs=(reachability_index, ancillas, best_size)) as executor:
+        futures = {executor.submit(_exhaustive_shard, r, first, deadline): (r, first) for r, first in shards}
+        for future in tqdm(as_completed(futures), total=len(futures), desc='Checking Out Exhaustive Uncomp Shards'):
+            try:
+                ancilla_set = future.result()
+            except TimeoutError:
+                for f in futures:
+                    f.cancel()
+                raise
+            if ancilla_set is not None:
+                found.append((futures[future], ancilla_set))
+
+    if len(found) == 0:
+        return ()
+
+    # Largest size, then lowest first ancilla, as in combinations order
+    _, largest_uncomputable = min(found, key=lambda x: (-x[0][0], x[0][1]))
+    return largest_uncomputable
+
+def descending_ancilla_sets(ancillas:List[str]):
+    '''
+    Lazily yield all ancilla sets from the largest to the empty one, in the same 
+    order as the reversed power set, without building the power set.
+    '''
+    n = len(ancillas)
+    for r in range(n, -1, -1):
+        # Complements of the (n-r)-sets in combinations order are the r-sets in reversed order
+        for removed in combinations(range(n), n-r):
+            removed = set(removed)
+            yield tuple(a for i, a in enumerate(ancillas) if i not in removed)
+
+def exhaustive_uncomputation_adding_reverse(circuit_graph: CircuitGraph, ancillas:List[str]):
+    '''
+    Exhaustively iterate over adding uncomputation for all possible ancillas, 
+    from the largest set down. Stops after the first size with an acyclic set.
+    '''
+    
+    largest_uncomputable = None
+    for ancilla_set in tqdm(descending_ancilla_sets(ancillas), total=2**len(ancillas), 
+                            desc='Checking Out Exhaustive Uncomp for All Ancillas'):
+        if largest_uncomputable is not None and len(ancilla_set) < len(largest_uncomputable):
+            break
+
         uncomp_circuit_graph, has_cycle = add_uncomputation(circuit_graph, list(ancilla_set))
         
         if not has_cycle: 
-            if len(ancilla_set) < len(largest_uncomputable):
-                break
             largest_uncomputable = ancilla_set
 
-    # print(largest_uncomputable)
     return largest_uncomputable
     
 # Method to remove an uncomputation node and restructure the edges
-def remove_uncomputation_step(uncomp_circuit_graph: rustworkx.PyDiGraph, idx):
+def remove_uncomputation_step(uncomp_circuit_graph: CircuitGraph, idx):
     comp_node_index = get_comp_node_index(uncomp_circuit_graph, idx)
 
-    adj_nodes = uncomp_circuit_graph.adj_direction(idx, False) # Get all outbound edges
-    # print(adj_nodes)
-
-    try:
-        controlled_idx = list(map(lambda x: x[0], list(filter(lambda x: x[1] == CONTROL, list(adj_nodes.items())))))
-    except IndexError:
-        controlled_idx = []
+    controlled_idx = uncomp_circuit_graph.controlled_by(idx) # Get all outbound control edges
 
     # try:
     #     target_edges = list(map(lambda x: x[0], list(filter(lambda x: x[1] == TARGET, list(adj_nodes.items())))))
@@ -239,7 +1098,7 @@ def remove_uncomputation_step(uncomp_circuit_graph: rustworkx.PyDiGraph, idx):
     #     pass
 
 
-    print(f'Controlled by the node {uncomp_circuit_graph.get_node_data(idx).simple_graph_label()} : {[uncomp_circuit_graph.get_node_data(c).simple_graph_label() for c in controlled_idx]}')
+    logger.debug(f'Controlled by the node {uncomp_circuit_graph.get_node_data(idx).simple_graph_label()} : {[uncomp_circuit_graph.get_node_data(c).simple_graph_label() for c in controlled_idx]}')
 
     uncomp_circuit_graph.remove_node(idx)
     
@@ -247,29 +1106,25 @@ def remove_uncomputation_step(uncomp_circuit_graph: rustworkx.PyDiGraph, idx):
     for idx in controlled_idx:
         uncomp_circuit_graph.add_edge(comp_node_index, idx, CONTROL)
         
-        adj_edges_leaving = uncomp_circuit_graph.adj_direction(comp_node_index, False)
-        next_node_idx = list(filter(lambda x: adj_edges_leaving[x] is TARGET, adj_edges_leaving.keys()))
-            # list(map(lambda x: x[0], list(filter(lambda x: x[1] == TARGET and not uncomp_circuit_graph.has_edge(x[0], idx), list(adj_edges_leaving.items())))))
+        next_node_idx = uncomp_circuit_graph.successors_by_type(comp_node_index, TARGET)
         if len(next_node_idx) > 1:
-            raise ValueError.add_note(f'searching for targets returned more than one value : {next_node_idx}') 
+            raise ValueError(f'searching for targets returned more than one value : {next_node_idx}') 
     
         uncomp_circuit_graph.add_edge(idx, next_node_idx[0], ANTIDEP)
 
 # Remove all uncomputation nodes for specified set of ancilla qubits 
-def remove_uncomputation_full(uncomp_circuit_graph:rustworkx.PyDiGraph, ancillas: List[str]):
+def remove_uncomputation_full(uncomp_circuit_graph:CircuitGraph, ancillas: List[str]):
     # circuit_graph = copy.deepcopy(uncomp_circuit_graph)
-    graph_nodes_reverse = uncomp_circuit_graph.nodes()
-    graph_nodes_reverse.reverse()
-    # print(graph_nodes_reverse)
-    for node in graph_nodes_reverse:
-        if node.label in ancillas and node.node_type is UNCOMP:
-            remove_uncomputation_step(uncomp_circuit_graph, node.index)
+    # Only the wires of the ancillas are walked, newest node first as in reversed nodes()
+    uncomp_nodes = chain.from_iterable(uncomp_circuit_graph.wire_nodes(a, UNCOMP) for a in set(ancillas))
+    for idx in sorted(uncomp_nodes, reverse=True):
+        remove_uncomputation_step(uncomp_circuit_graph, idx)
 
     
     return uncomp_circuit_graph
 
 # Exhaustive Uncomp implementation by removing uncomputation for subset of ancilla
-def exhaustive_uncomputation_removing(circuit_graph: rustworkx.PyDiGraph, ancillas: List[str]):
+def exhaustive_uncomputation_removing(circuit_graph: CircuitGraph, ancillas: List[str]):
     
     # ancillas = list(range(num_qubit, num_qubit+num_ancilla))
     ancillas_power_set = chain.from_iterable(combinations(ancillas, r) for r in range(len(ancillas)+1))
@@ -290,8 +1145,302 @@ def exhaustive_uncomputation_removing(circuit_graph: rustworkx.PyDiGraph, ancill
 
     return smallest_removable
 
+# Exact Uncomp as a MILP - one binary variable per ancilla, and a cut 
+# sum(x_a for a in C) <= |C| - 1 for every set C known to cause a cycle
+def milp_uncomputation(circuit_graph: CircuitGraph, ancillas:List[str], max_seed_cycles:int=100, return_uncomputed_ancillas=False, 
+                       graph_nodes_reverse:List[int]=None, full_uncomp_graph: CircuitGraph=None, cache:UncompCache=None, 
+                       cyclic_sets:List[tuple]=None, reachability_index:ReachabilityIndex=None):
+    '''
+    Largest set of ancillas that can be uncomputed without a cycle, solved with 
+    scipy.optimize.milp. Cuts are seeded from cyclic_sets, the ancilla sets already 
+    known to be cyclic, and the cycles of the fully uncomputed graph, and added lazily: every solution that is still cyclic adds a cut for 
+    the ancillas on its cycle, until the solution is acyclic and so optimal. 
+    Ties between sets of the same size may be broken differently than exhaustive.
+    A cut only holds while none of the influencers on its cycle is uncomputed 
+    as well, see exhaustive_uncomputation_pruned. Solutions are checked on the 
+    reachability index, the uncomp graph is built once for the final one.
+    '''
+    ancillas = list(ancillas)
+    ancilla_pos = {a: i for i, a in enumerate(ancillas)}
+    influencers = get_ancilla_influencers(circuit_graph, ancillas)
+    cuts = []
+    cut_bounds = []
+    if graph_nodes_reverse is None:
+        graph_nodes_reverse = get_reverse_topological_order(circuit_graph)
+    if reachability_index is None:
+        reachability_index = ReachabilityIndex(circuit_graph, graph_nodes_reverse)
+    infeasible = get_infeasible_ancillas(circuit_graph, ancillas, influencers, graph_nodes_reverse, reachability_index)
+
+    # sum(x[cyclic_set]) - sum(x[cycle_influencers]) <= len(cyclic_set) - 1
+    def add_cut(cyclic_set, cycle_influencers):
+        row = numpy.zeros(len(ancillas))
+        row[[ancilla_pos[b] for b in cycle_influencers]] = -1
+        row[[ancilla_pos[a] for a in cyclic_set]] = 1
+        cuts.append(row)
+        cut_bounds.append(len(cyclic_set) - 1)
+        logger.info(f'Ancillas {cyclic_set} cause a cycle, adding cut')
+
+    # The last core cut always excludes the set, see get_cyclic_ancilla_cores
+    def add_core_cut(ancilla_set):
+        for core, cycle_influencers in get_cyclic_ancilla_cores(circuit_graph, ancilla_set, influencers, reachability_index):
+            add_cut(core, cycle_influencers)
+
+    for cyclic_set in cyclic_sets or []:
+        if all(a in ancilla_pos for a in cyclic_set):
+            add_cut(cyclic_set, get_cycle_influencers(circuit_graph, cyclic_set, influencers, reachability_index=reachability_index))
+
+    # Seed the cuts from the cycles of the fully uncomputed graph. A cycle is 
+    # only a cut once the set of its ancillas is checked to be cyclic by itself.
+    fingerprint = graph_fingerprint(circuit_graph) if cache is not None else None
+    if full_uncomp_graph is None:
+        full_uncomp_graph, has_cycle = add_uncomputation(circuit_graph, ancillas, allow_cycle=True, graph_nodes_reverse=graph_nodes_reverse, 
+                                                         cache=cache, fingerprint=fingerprint)
+    if len(full_uncomp_graph.find_cycle()) > 0:
+        seen_sets = set()
+        for cycle in islice(rustworkx.simple_cycles(full_uncomp_graph), max_seed_cycles):
+            cycle_set = frozenset(full_uncomp_graph.get_node_data(idx).label for idx in cycle 
+                                  if full_uncomp_graph.get_node_data(idx).node_type is UNCOMP)
+            if cycle_set in seen_sets:
+                continue
+            seen_sets.add(cycle_set)
+
+            ancilla_set = [a for a in ancillas if a in cycle_set]
+            if reachability_index.would_cycle(ancilla_set):
+                add_core_cut(ancilla_set)
+
+    # Maximise the number of uncomputed ancillas
+    objective = -numpy.ones(len(ancillas))
+    integrality = numpy.ones(len(ancillas))
+    bounds = scipy.optimize.Bounds(0, [0 if a in infeasible else 1 for a in ancillas])
+
+    iteration = 0
+    while True:
+        iteration += 1
+        constraints = []
+        if len(cuts):
+            cut_matrix = numpy.array(cuts)
+            constraints.append(scipy.optimize.LinearConstraint(cut_matrix, -numpy.inf, numpy.array(cut_bounds)))
+
+        result = scipy.optimize.milp(objective, integrality=integrality, bounds=bounds, constraints=constraints)
+        if not result.success:
+            raise ValueError(f'MILP for ancillas {ancillas} failed: {result.message}')
+
+        ancilla_set = tuple(a for a, x in zip(ancillas, result.x) if x > 0.5)
+        if not reachability_index.would_cycle(ancilla_set):
+            break
+        add_core_cut(ancilla_set)
+
+    logger.info(f'MILP Uncomp found {ancilla_set} after {iteration} solves and {len(cuts)} cuts')
+    uncomp_circuit_graph, has_cycle = add_uncomputation(circuit_graph, list(ancilla_set), graph_nodes_reverse=graph_nodes_reverse, 
+                                                        cache=cache, fingerprint=fingerprint)
+
+    if return_uncomputed_ancillas:
+        return uncomp_circuit_graph, ancilla_set
+    else:
+        return uncomp_circuit_graph
+
+# Count, for every ancilla, the uncomp nodes over the simple cycles of the graph
+def count_uncomp_nodes_in_cycles(uncomp_circuit_graph: CircuitGraph, ancillas:List[str], max_cycles:int=10**5):
+    uncomp_cycle_counter = collections.Counter({i:0 for i in ancillas})
+    uncomp_cycle_nodes = collections.UserDict({i:collections.UserList([]) for i in ancillas})
+    # comp_cycle_counter = collections.Counter({i:0 for i in range(num_qubit+num_ancilla)})
+
+    # Inbuilt Johnson's algorithm to find all simple cycles
+    simple_cycles = rustworkx.simple_cycles(uncomp_circuit_graph)
+    
+    # Max iterations to run the loop for, as number of cycles can 
+    # easily cross 1B (and take >1day to successively parse through)
+    # max_cycles = 10**5
+    cycle_counter = 0
+    for cycle in tqdm(simple_cycles, desc=f'Iterating over all cycles in graph', total=max_cycles):
+        # print(cycle)
+        # For each node in cycle, update the counter based on whether it's an uncomp node or comp node
+        for idx in cycle:
+            node = uncomp_circuit_graph.get_node_data(idx)
+            if node.qubit_type is ANCILLA: 
+                if node.node_type is UNCOMP:
+                    uncomp_cycle_counter[node.label] +=1
+                    uncomp_cycle_nodes[node.label].append(idx)
+                # else:
+                #     comp_cycle_counter[node.qubit_wire] +=1
+    
+        if cycle_counter > max_cycles:
+            break
+        
+        cycle_counter+=1
+
+    return uncomp_cycle_counter, uncomp_cycle_nodes
+
+# Score every ancilla by its uncomp nodes in the strongly connected components 
+# of the graph, a node is in a cycle iff its SCC has more than one node. 
+def score_uncomp_nodes_in_sccs(uncomp_circuit_graph: CircuitGraph, ancillas:List[str], sccs=None):
+    '''
+    An uncomp node scores in_degree * out_degree over the edges inside its SCC, the 
+    number of ways a cycle can pass through it. Linear in the size of the graph.
+    '''
+    if sccs is None:
+        sccs = uncomp_circuit_graph.strongly_connected_components()
+
+    uncomp_cycle_counter = collections.Counter({i:0 for i in ancillas})
+    uncomp_cycle_nodes = collections.UserDict({i:collections.UserList([]) for i in ancillas})
+
+    for scc in sccs:
+        if len(scc) < 2:
+            continue
+        scc_nodes = set(scc)
+        for idx in scc:
+            node = uncomp_circuit_graph.get_node_data(idx)
+            if node.qubit_type is ANCILLA and node.node_type is UNCOMP:
+                in_degree = sum(1 for x in uncomp_circuit_graph.predecessor_indices(idx) if x in scc_nodes)
+                out_degree = sum(1 for x in uncomp_circuit_graph.successor_indices(idx) if x in scc_nodes)
+                uncomp_cycle_counter[node.label] += in_degree * out_degree
+                uncomp_cycle_nodes[node.label].append(idx)
+
+    return uncomp_cycle_counter, uncomp_cycle_nodes
+
+# Estimate the cycle counts of count_uncomp_nodes_in_cycles from random cycles
+def sample_uncomp_nodes_in_cycles(uncomp_circuit_graph: CircuitGraph, ancillas:List[str], sccs=None, 
+                                  sample_time:float=1.0, min_samples:int=100, z:float=1.96, seed=None):
+    '''
+    Random walks from the uncomp nodes in cyclic SCCs, staying inside the SCC until 
+    a node repeats, give a random simple cycle. Each ancilla scores the number of 
+    its uncomp nodes over the sampled cycles. Sampling stops once the mean of the 
+    top ancilla is z standard errors clear of the runner-up, or after sample_time 
+    seconds.
+    '''
+    if sccs is None:
+        sccs = uncomp_circuit_graph.strongly_connected_components()
+    rng = random.Random(seed)
+
+    uncomp_cycle_counter = collections.Counter({i:0 for i in ancillas})
+    uncomp_cycle_nodes = collections.UserDict({i:collections.UserList([]) for i in ancillas})
+    squares = collections.Counter({i:0 for i in ancillas})
+
+    # Successors of every node inside its own SCC, and the start nodes of the walks
+    scc_successors = {}
+    start_nodes = []
+    for scc in sccs:
+        if len(scc) < 2:
+            continue
+        scc_nodes = set(scc)
+        for idx in scc:
+            scc_successors[idx] = [x for x in uncomp_circuit_graph.successor_indices(idx) if x in scc_nodes]
+            node = uncomp_circuit_graph.get_node_data(idx)
+            if node.qubit_type is ANCILLA and node.node_type is UNCOMP:
+                start_nodes.append(idx)
+
+    if len(start_nodes) == 0:
+        return uncomp_cycle_counter, uncomp_cycle_nodes
+
+    end_time = time.time() + sample_time
+    num_samples = 0
+    while True:
+        walk = [rng.choice(start_nodes)]
+        position = {walk[0]: 0}
+        while True:
+            next_idx = rng.choice(scc_successors[walk[-1]])
+            if next_idx in position:
+                break
+            position[next_idx] = len(walk)
+            walk.append(next_idx)
+
+        # The walk from the first visit of the repeated node is a simple cycle
+        sample_counter = collections.Counter()
+        for idx in walk[position[next_idx]:]:
+            node = uncomp_circuit_graph.get_node_data(idx)
+            if node.qubit_type is ANCILLA and node.node_type is UNCOMP:
+                sample_counter[node.label] += 1
+                uncomp_cycle_nodes[node.label].append(idx)
+        for label, count in sample_counter.items():
+            uncomp_cycle_counter[label] += count
+            squares[label] += count**2
+        num_samples += 1
+
+        if time.time() > end_time:
+            break
+        if num_samples >= min_samples and num_samples % 10 == 0:
+            (first, first_sum), (second, second_sum) = (uncomp_cycle_counter.most_common(2) + [(None, 0)])[:2]
+            first_mean, second_mean = first_sum / num_samples, second_sum / num_samples
+            first_err = math.sqrt(max(squares[first] / num_samples - first_mean**2, 0) / num_samples)
+            second_err = math.sqrt(max(squares[second] / num_samples - second_mean**2, 0) / num_samples) if second is not None else 0
+            if first_mean - z * first_err > second_mean + z * second_err:
+                break
+
+    logger.info(f'Sampled {num_samples} cycles, top ancillas {uncomp_cycle_counter.most_common(2)}')
+    return uncomp_cycle_counter, uncomp_cycle_nodes
+
+# Score every ancilla by the closed walks through its uncomp nodes, the diagonal of the 
+# resolvent (I - alpha A)^-1 of each SCC solved from one sparse LU
+def closed_walk_uncomp_scores(uncomp_circuit_graph: CircuitGraph, ancillas:List[str], sccs=None, solve_chunk:int=256):
+    '''
+    For every ancilla uncomp node the weighted number of closed walks through it, 
+    sum over k >= 1 of (alpha A)^k[i, i] = (I - alpha A)^-1[i, i] - 1, with A the adjacency 
+    matrix of its SCC (closed walks never leave it) and alpha below 1 / spectral radius. 
+    Walks of every length count. The diagonal comes from one sparse LU of I - alpha A 
+    per SCC and a solve for the columns of the scored nodes, solve_chunk at a time, 
+    without forming matrix powers. The node scores are summed per ancilla with 
+    numpy.bincount, all zero scores fall back to score_uncomp_nodes_in_sccs.
+    '''
+    if sccs is None:
+        sccs = uncomp_circuit_graph.strongly_connected_components()
+
+    ancilla_pos = {a: i for i, a in enumerate(ancillas)}
+    uncomp_cycle_nodes = collections.UserDict({i:collections.UserList([]) for i in ancillas})
+    node_positions = []
+    node_scores = []
+
+    for scc in sccs:
+        if len(scc) < 2:
+            continue
+        # Every node of an SCC with more than one node is on a cycle
+        scored = []
+        for i, idx in enumerate(scc):
+            node = uncomp_circuit_graph.get_node_data(idx)
+            if node.qubit_type is ANCILLA and node.node_type is UNCOMP and node.label in ancilla_pos:
+                scored.append(i)
+                node_positions.append(ancilla_pos[node.label])
+                uncomp_cycle_nodes[node.label].append(idx)
+        if len(scored) == 0:
+            continue
+
+        position = {idx: i for i, idx in enumerate(scc)}
+        edges = [(position[parent], position[child]) for parent in scc 
+                 for child in uncomp_circuit_graph.successor_indices(parent) if child in position]
+        rows, cols = zip(*edges)
+        adjacency = scipy.sparse.csc_matrix((numpy.ones(len(edges)), (rows, cols)), shape=(len(scc), len(scc)))
+
+        # The spectral radius is at most the largest out degree
+        alpha = 0.9 / adjacency.sum(axis=1).max()
+        resolvent = scipy.sparse.linalg.splu(scipy.sparse.identity(len(scc), format='csc') - alpha * adjacency)
+        for start in range(0, len(scored), solve_chunk):
+            chunk = scored[start:start + solve_chunk]
+            unit_columns = numpy.zeros((len(scc), len(chunk)))
+            unit_columns[chunk, range(len(chunk))] = 1
+            diagonal = resolvent.solve(unit_columns)[chunk, range(len(chunk))] - 1
+            node_scores.extend(numpy.maximum(diagonal, 0).tolist())
+
+    ancilla_scores = numpy.bincount(numpy.array(node_positions, dtype=int), weights=node_scores, minlength=len(ancillas))
+    if not ancilla_scores.any():
+        return score_uncomp_nodes_in_sccs(uncomp_circuit_graph, ancillas, sccs)
+    uncomp_cycle_counter = collections.Counter(dict(zip(ancillas, ancilla_scores.tolist())))
+    return uncomp_cycle_counter, uncomp_cycle_nodes
+
+# Scores of the greedy procedures - how much each ancilla's uncomp nodes take part in cycles, 
+# and which of its uncomp nodes are in a cycle
+def get_greedy_scores(uncomp_circuit_graph: CircuitGraph, ancillas:List[str], metric='cycles', max_cycles:int=10**5, sccs=None, sample_time:float=1.0):
+    if metric == 'cycles':
+        return count_uncomp_nodes_in_cycles(uncomp_circuit_graph, ancillas, max_cycles)
+    elif metric == 'scc':
+        return score_uncomp_nodes_in_sccs(uncomp_circuit_graph, ancillas, sccs)
+    elif metric == 'sampled':
+        return sample_uncomp_nodes_in_cycles(uncomp_circuit_graph, ancillas, sccs, sample_time)
+    elif metric == 'walks':
+        return closed_walk_uncomp_scores(uncomp_circuit_graph, ancillas, sccs)
+    else:
+        raise ValueError(f'Unknown greedy metric {metric}')
+
 # Greedily remove uncomputation - ALL UNCOMP NODES FOR VALID ANCILLA    
-def greedy_uncomputation_full_weak(circuit_graph: rustworkx.PyDiGraph, ancillas):
+def greedy_uncomputation_full_weak(circuit_graph: CircuitGraph, ancillas):
     
     start_time = time.time_ns()
     # ancillas = list(range(num_qubit, num_qubit+num_ancilla))
@@ -316,58 +1465,59 @@ def greedy_uncomputation_full_weak(circuit_graph: rustworkx.PyDiGraph, ancillas)
 
 
 
+# Fallback for the greedy loops when they run out of time
+def remove_cyclic_uncomputation(uncomp_circuit_graph: CircuitGraph, ancillas:List[str], cycle_check):
+    '''
+    Remove all uncomp nodes of every ancilla with an uncomp node in a cyclic component, 
+    until the graph is acyclic. Returns the ancillas that were removed.
+    '''
+    removed = []
+    while len(cycle_check) > 0:
+        in_cycles = {uncomp_circuit_graph.get_node_data(idx).label for component in cycle_check for idx in component 
+                     if uncomp_circuit_graph.get_node_data(idx).node_type is UNCOMP}
+        to_remove = [a for a in ancillas if a in in_cycles and a not in removed]
+        if len(to_remove) == 0:
+            # Cycles only through comp nodes, drop the uncomp of all ancillas
+            to_remove = [a for a in ancillas if a not in removed]
+        
+        remove_uncomputation_full(uncomp_circuit_graph, to_remove)
+        removed.extend(to_remove)
+        cycle_check = uncomp_circuit_graph.cyclic_components()
+
+    return removed
+
 # Greedily remove uncomputation - ALL UNCOMP NODES FOR VALID ANCILLA    
-def greedy_uncomputation_full(circuit_graph: rustworkx.PyDiGraph, ancillas:List[str], max_cycles:int=10**5, return_uncomputed_ancillas=False):
-    
+def greedy_uncomputation_full(circuit_graph: CircuitGraph, ancillas:List[str], max_cycles:int=10**5, return_uncomputed_ancillas=False, 
+                              metric:Literal['cycles', 'scc', 'sampled', 'walks']='cycles', sample_time:float=1.0, 
+                              time_budget:float=None, full_uncomp_graph: CircuitGraph=None, cache:UncompCache=None):
+    '''
+    With a time_budget in seconds, the greedy loop stops when it runs out and the 
+    uncomp of all ancillas still in cycles is removed. The result then ends with a 
+    flag, True if the greedy loop converged.
+    '''
+    deadline = get_deadline(time_budget)
     start_time = time.time_ns()
     # ancillas = list(range(num_qubit, num_qubit+num_ancilla))
-    uncomp_circuit_graph, has_cycle = add_uncomputation(circuit_graph, ancillas, allow_cycle=True)
+    uncomp_circuit_graph = get_full_uncomp_graph(circuit_graph, ancillas, full_uncomp_graph, cache)
     # logger.info(f'Time to build Greedy Uncomp Circuit Graph with cycles took {time.time_ns()-start_time} ns')
     uncomp_ancillas_list = copy.deepcopy(ancillas)
     # start_time = time.time_ns()
 
-    cycle_check = rustworkx.digraph_find_cycle(uncomp_circuit_graph)
+    cycle_check = uncomp_circuit_graph.cyclic_components()
     # logger.info(f'Time to check for cycle in Greedy Uncomp Circuit Graph took {time.time_ns()-start_time} ns')
     # start_time = time.time_ns()
     
+    converged = True
     while len(cycle_check) > 0:
-        uncomp_cycle_counter = collections.Counter({i:0 for i in ancillas})
-        # comp_cycle_counter = collections.Counter({i:0 for i in range(num_qubit+num_ancilla)})
-
-        # Inbuilt Johnson's algorithm to find all simple cycles
-        simple_cycles = rustworkx.simple_cycles(uncomp_circuit_graph)
-        # logger.info(f'Time to get all simple cycles using Johnsons in Greedy Uncomp Circuit Graph took {time.time_ns()-start_time} ns')
-        # start_time = time.time_ns()
-        
-        # Max iterations to run the loop for, as number of cycles can 
-        # easily cross 1B (and take >1day to successively parse through)
-        # max_cycles = 10**5
-        cycle_counter = 0
-        for cycle in tqdm(simple_cycles, desc=f'Iterating over all cycles in graph', total=max_cycles):
-            # print(cycle)
-            # For each node in cycle, update the counter based on whether it's an uncomp node or comp node
-            for idx in cycle:
-                node = uncomp_circuit_graph.get_node_data(idx)
-                if node.qubit_type is ANCILLA: 
-                    if node.node_type is UNCOMP:
-                        uncomp_cycle_counter[node.label] +=1
-                    # else:
-                    #     comp_cycle_counter[node.qubit_wire] +=1
+        if deadline_passed(deadline):
+            logger.info(f'Greedy uncomp ran out of time, removing all ancillas still in cycles')
+            for qubit in remove_cyclic_uncomputation(uncomp_circuit_graph, uncomp_ancillas_list, cycle_check):
+                uncomp_ancillas_list.remove(qubit)
+            converged = False
+            break
         
-            if cycle_counter > max_cycles:
-                break
-            
-            cycle_counter+=1
-
-        # logger.info(f'There are a total of {len(list(simple_cycles))} in the graph, and a total of {sum([len(x) for x in simple_cycles])} labels to check')
-        # print(f'There are a total of {len(list(simple_cycles))} simple cycles in the circuit graph.')
-        # logger.info(f'There are a total of {len(List(simple_cycles))} simple cycles in the circuit graph.')
-
-        # uncomp_cycle_labels = [uncomp_circuit_graph.get_node_data(idx).label for cycle in simple_cycles for idx in cycle if uncomp_circuit_graph.get_node_data(idx).node_type is UNCOMP]
-        # uncomp_cycle_counter = collections.Counter(uncomp_cycle_labels)
-
-        # logger.info(f'Time to get ancilla qubits with most cycles in Greedy Uncomp Circuit Graph took {time.time_ns()-start_time} ns')
-        # start_time = time.time_ns()
+        uncomp_cycle_counter, _ = get_greedy_scores(uncomp_circuit_graph, ancillas, metric, max_cycles, cycle_check, 
+                                                    remaining_sample_time(sample_time, deadline))
 
         # Debugging warning, can be ignored as cycles can be introduced with the comp nodes 
         # AFTER adding uncomputation, which should be removed after greedy procedure
@@ -395,16 +1545,20 @@ def greedy_uncomputation_full(circuit_graph: rustworkx.PyDiGraph, ancillas:List[
         
         # start_time = time.time_ns()
 
-        cycle_check = rustworkx.digraph_find_cycle(uncomp_circuit_graph)
+        cycle_check = uncomp_circuit_graph.cyclic_components()
 
-    if return_uncomputed_ancillas:     
+    if return_uncomputed_ancillas and deadline is not None:
+        return uncomp_circuit_graph, uncomp_ancillas_list, converged
+    elif return_uncomputed_ancillas:     
         return uncomp_circuit_graph, uncomp_ancillas_list 
+    elif deadline is not None:
+        return uncomp_circuit_graph, converged
     else: 
         return uncomp_circuit_graph
 
 
 # Greedily remove uncomputation - ALL UNCOMP NODES FOR VALID ANCILLA    
-def greedy_uncomputation_full_per_node(circuit_graph: rustworkx.PyDiGraph, ancillas):
+def greedy_uncomputation_full_per_node(circuit_graph: CircuitGraph, ancillas, metric:Literal['paths', 'walks']='paths'):
     
     start_time = time.time_ns()
     # ancillas = list(range(num_qubit, num_qubit+num_ancilla))
@@ -412,20 +1566,23 @@ def greedy_uncomputation_full_per_node(circuit_graph: rustworkx.PyDiGraph, ancil
     logger.info(f'Time to build Greedy Uncomp Circuit Graph with cycles took {time.time_ns()-start_time} ns')
     start_time = time.time_ns()
 
-    cycle_check = rustworkx.digraph_find_cycle(uncomp_circuit_graph)
+    cycle_check = uncomp_circuit_graph.cyclic_components()
     logger.info(f'Time to check for cycle in Greedy Uncomp Circuit Graph took {time.time_ns()-start_time} ns')
     start_time = time.time_ns()
     
     while len(cycle_check) > 0:
-        uncomp_cycle_counter = collections.Counter({i:0 for i in ancillas})
+        if metric == 'walks':
+            uncomp_cycle_counter, _ = closed_walk_uncomp_scores(uncomp_circuit_graph, ancillas, cycle_check)
+        else:
+            uncomp_cycle_counter = collections.Counter({i:0 for i in ancillas})
 
-        for idx in uncomp_circuit_graph.node_indices():
-            node = uncomp_circuit_graph.get_node_data(idx)
+            for idx in uncomp_circuit_graph.node_indices():
+                node = uncomp_circuit_graph.get_node_data(idx)
 
-            if node.label in ancillas and node.node_type == UNCOMP:
-                logger.info(f'Getting all simple paths for node {node}')
-                all_simple_cycles_for_node = rustworkx.all_simple_paths(uncomp_circuit_graph, idx, idx)
-                uncomp_cycle_counter[node.label] += len(all_simple_cycles_for_node)
+                if node.label in ancillas and node.node_type == UNCOMP:
+                    logger.info(f'Getting all simple paths for node {node}')
+                    all_simple_cycles_for_node = rustworkx.all_simple_paths(uncomp_circuit_graph, idx, idx)
+                    uncomp_cycle_counter[node.label] += len(all_simple_cycles_for_node)
 
         qubit, num_cycles = uncomp_cycle_counter.most_common(1)[0]
         print(qubit, num_cycles)
@@ -435,23 +1592,112 @@ def greedy_uncomputation_full_per_node(circuit_graph: rustworkx.PyDiGraph, ancil
         logger.info(f'Removing all uncomputation nodes for {qubit}')
         uncomp_circuit_graph = remove_uncomputation_full(uncomp_circuit_graph, [qubit])
 
-        cycle_check = rustworkx.digraph_find_cycle(uncomp_circuit_graph)
+        cycle_check = uncomp_circuit_graph.cyclic_components()
 
     return uncomp_circuit_graph
 
 
+# Set once in every worker process of beam_uncomputation
+_beam_uncomp_graph = None
+_beam_ancillas = None
+_beam_metric = None
+_beam_expand = None
+
+def _init_beam_worker(uncomp_circuit_graph: CircuitGraph, ancillas:List[str], metric, expand):
+    global _beam_uncomp_graph, _beam_ancillas, _beam_metric, _beam_expand
+    _beam_uncomp_graph = uncomp_circuit_graph
+    _beam_ancillas = ancillas
+    _beam_metric = metric
+    _beam_expand = expand
+
+def _evaluate_removals(removed):
+    '''
+    Remove the uncomputation of the ancillas in removed from the fully uncomputed graph. 
+    Returns the number of nodes still on a cycle and the best ancillas to remove next.
+    '''
+    uncomp_circuit_graph = _beam_uncomp_graph.clone()
+    for qubit in removed:
+        remove_uncomputation_full(uncomp_circuit_graph, [qubit])
+
+    cyclic_components = uncomp_circuit_graph.cyclic_components()
+    if len(cyclic_components) == 0:
+        return removed, 0, []
+
+    remaining = [a for a in _beam_ancillas if a not in removed]
+    uncomp_cycle_counter, _ = get_greedy_scores(uncomp_circuit_graph, remaining, _beam_metric, sccs=cyclic_components)
+    candidates = [a for a, score in uncomp_cycle_counter.most_common(_beam_expand) if score > 0]
+    return removed, sum(len(c) for c in cyclic_components), candidates
+
+# Beam search over the greedy removal sequences - keeps the beam_width best partial 
+# sequences and extends each with its expand best ancillas every step
+def beam_uncomputation(circuit_graph: CircuitGraph, ancillas:List[str], beam_width:int=4, expand:int=3, 
+                       metric:Literal['cycles', 'scc', 'sampled', 'walks']='scc', max_workers=None, 
+                       return_uncomputed_ancillas=False, full_uncomp_graph: CircuitGraph=None):
+    '''
+    Sequences are ranked by the number of nodes left on cycles, the first step where 
+    a sequence leaves no cycle gives the ancillas to keep uncomputed. beam_width=1 and 
+    expand=1 is greedy_uncomputation_full only when both use the same metric, the 
+    defaults differ ('scc' here, 'cycles' there). Candidates are evaluated in a process pool, 
+    max_workers=1 evaluates them in this process.
+    '''
+    ancillas = list(ancillas)
+    if full_uncomp_graph is None:
+        full_uncomp_graph, has_cycle = add_uncomputation(circuit_graph, ancillas, allow_cycle=True)
+
+    if max_workers == 1:
+        _init_beam_worker(full_uncomp_graph, ancillas, metric, expand)
+        executor = None
+        evaluate = lambda sequences: list(map(_evaluate_removals, sequences))
+    else:
+        executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_beam_worker, 
+                                       initargs=(full_uncomp_graph, ancillas, metric, expand))
+        evaluate = lambda sequences: list(executor.map(_evaluate_removals, sequences))
+
+    try:
+        results = evaluate([()])
+        while True:
+            solved = [removed for removed, cyclic_nodes, _ in results if cyclic_nodes == 0]
+            if len(solved):
+                removed = solved[0]
+                break
+
+            results.sort(key=lambda x: x[1])
+            sequences = []
+            seen = set()
+            for removed, _, candidates in results[:beam_width]:
+                for qubit in candidates:
+                    key = frozenset(removed + (qubit,))
+                    if key not in seen:
+                        seen.add(key)
+                        sequences.append(removed + (qubit,))
+
+            if len(sequences) == 0:
+                raise ValueError('No ancilla to remove left, but the graph still has cycles')
+            logger.info(f'Beam search evaluating {len(sequences)} sequences of {len(sequences[0])} removals')
+            results = evaluate(sequences)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    uncomp_circuit_graph = full_uncomp_graph.clone()
+    for qubit in removed:
+        remove_uncomputation_full(uncomp_circuit_graph, [qubit])
+    uncomp_ancillas_list = [a for a in ancillas if a not in removed]
+
+    if return_uncomputed_ancillas:     
+        return uncomp_circuit_graph, uncomp_ancillas_list 
+    else: 
+        return uncomp_circuit_graph
+
 # Remove uncomputation of 'singular ancilla' until first node that controls ancilla is reached
-def remove_uncomputation_partial(uncomp_circuit_graph:rustworkx.PyDiGraph, ancilla: str, nodes_in_cycle:List[int]):
+def remove_uncomputation_partial(uncomp_circuit_graph:CircuitGraph, ancilla: str, nodes_in_cycle:List[int]):
     # uncomp_circuit_graph = copy.deepcopy(uncomp_circuit_graph)
-    graph_nodes_reverse = uncomp_circuit_graph.nodes()
-    graph_nodes_reverse.reverse()
-    # print(graph_nodes_reverse)
     # Initialize node for this will have same index as ancilla
 
     # Get all outward/leaving edges of the FIRST/INIT node of the ancilla
     # This is because when we build the circuit graph, the index of INIT node is the same as the index of qubit. 
     # ancilla_idx = list(filter(lambda x: ,init_nodes))
-    target_path = [x.get_index() for x in uncomp_circuit_graph.nodes() if x.label == ancilla]
+    target_path = uncomp_circuit_graph.wire_nodes(ancilla)
 
 
     # Nodes in cycle is the list of all nodes that are a part of a cycle
@@ -474,11 +1720,9 @@ def remove_uncomputation_partial(uncomp_circuit_graph:rustworkx.PyDiGraph, ancil
     # If so, check if the node controls any ancilla. If it does, then break or else remove it. 
     for idx in target_path:
         if idx in uncomp_nodes_part_of_cycle:
-            # Get all outward/leaving edges
-            idx_adj_nodes = uncomp_circuit_graph.adj_direction(idx, False)
             # Get all nodes for which this node is a control and the controlled node is an uncomp node. 
-            controlled_nodes = list(filter(lambda x: idx_adj_nodes.get(x) is CONTROL and uncomp_circuit_graph.get_node_data(x).node_type is UNCOMP, 
-                                   idx_adj_nodes.keys()))
+            controlled_nodes = [x for x in uncomp_circuit_graph.controlled_by(idx) 
+                                if uncomp_circuit_graph.get_node_data(x).node_type is UNCOMP]
             # idx_cycles = qubit_node_cycles[idx]
             # print(f'{idx} : {idx_cycles}')
 
@@ -498,7 +1742,7 @@ def remove_uncomputation_partial(uncomp_circuit_graph:rustworkx.PyDiGraph, ancil
                 #         print(f'Node {c} is in a loop, so node {idx} will be removed')
                 #         remove_uncomputation_step(circuit_graph, idx)
                 #         break
-                uncomp_circuit_graph.get_node_data(idx).mark_node()
+                uncomp_circuit_graph.set_node_flags(idx, mark=True)
                 break
         
     return uncomp_circuit_graph
@@ -506,39 +1750,33 @@ def remove_uncomputation_partial(uncomp_circuit_graph:rustworkx.PyDiGraph, ancil
 # Greedy - Partial Uncomp 
 # Same as Greedy - Full, but has an addition dictionary that stores 
 # the nodes of a qubit that are in the cycle
-def greedy_uncomputation_partial(circuit_graph: rustworkx.PyDiGraph, ancillas:List[str], max_cycles:int=10**5, return_uncomputed_ancillas=False):
+def greedy_uncomputation_partial(circuit_graph: CircuitGraph, ancillas:List[str], max_cycles:int=10**5, return_uncomputed_ancillas=False, 
+                                 metric:Literal['cycles', 'scc', 'sampled', 'walks']='cycles', sample_time:float=1.0, 
+                                 time_budget:float=None, full_uncomp_graph: CircuitGraph=None, cache:UncompCache=None):
+    '''
+    time_budget works as in greedy_uncomputation_full.
+    '''
+    deadline = get_deadline(time_budget)
 
     # ancillas = list(range(num_qubit, num_qubit+num_ancilla))
-    uncomp_circuit_graph, has_cycle = add_uncomputation(circuit_graph, ancillas, allow_cycle=True)
+    uncomp_circuit_graph = get_full_uncomp_graph(circuit_graph, ancillas, full_uncomp_graph, cache)
     
     uncomp_ancillas_list = copy.deepcopy(ancillas)
 
-    cycle_check = rustworkx.digraph_find_cycle(uncomp_circuit_graph)
+    cycle_check = uncomp_circuit_graph.cyclic_components()
 
+    converged = True
     while len(cycle_check) > 0:
-        uncomp_cycle_counter = collections.Counter({i:0 for i in ancillas})
-        uncomp_cycle_nodes = collections.UserDict({i:collections.UserList([]) for i in ancillas})
-
-        simple_cycles = rustworkx.simple_cycles(uncomp_circuit_graph)
+        if deadline_passed(deadline):
+            logger.info(f'Greedy uncomp ran out of time, removing all ancillas still in cycles')
+            for qubit in remove_cyclic_uncomputation(uncomp_circuit_graph, ancillas, cycle_check):
+                if qubit in uncomp_ancillas_list:
+                    uncomp_ancillas_list.remove(qubit)
+            converged = False
+            break
         
-        # Max iterations to run the loop for, as number of cycles can 
-        # easily cross 1B (and take >1day to successively parse through)        
-        # max_cycles = 10**5
-        cycle_counter = 0
-        for cycle in tqdm(simple_cycles, desc='Iterating over all cycles', total=max_cycles):
-            # print(cycle)
-            for idx in cycle:
-                node = uncomp_circuit_graph.get_node_data(idx)
-                # node_cycle_dict[idx].append([i for i in cycle])
-                if node.qubit_type is ANCILLA: 
-                    if node.node_type is UNCOMP:
-                        uncomp_cycle_counter[node.label] +=1
-                        uncomp_cycle_nodes[node.label].append(idx)
-            
-            if cycle_counter > max_cycles:
-                break
-            
-            cycle_counter += 1
+        uncomp_cycle_counter, uncomp_cycle_nodes = get_greedy_scores(uncomp_circuit_graph, ancillas, metric, max_cycles, cycle_check, 
+                                                                     remaining_sample_time(sample_time, deadline))
             
         qubit, num_cycles = uncomp_cycle_counter.most_common(1)[0]
         print(qubit, num_cycles)
@@ -548,13 +1786,331 @@ def greedy_uncomputation_partial(circuit_graph: rustworkx.PyDiGraph, ancillas:Li
         if qubit in uncomp_ancillas_list:
             uncomp_ancillas_list.remove(qubit)
 
-        cycle_check = rustworkx.digraph_find_cycle(uncomp_circuit_graph)
+        cycle_check = uncomp_circuit_graph.cyclic_components()
 
-    if return_uncomputed_ancillas:     
+    if return_uncomputed_ancillas and deadline is not None:
+        return uncomp_circuit_graph, uncomp_ancillas_list, converged
+    elif return_uncomputed_ancillas:     
         return uncomp_circuit_graph, uncomp_ancillas_list 
+    elif deadline is not None:
+        return uncomp_circuit_graph, converged
     else: 
         return uncomp_circuit_graph
 
 
+# Exact Partial Uncomp - how many of its last comp nodes every ancilla uncomputes, 
+# by branch and bound over these cut points
+def exact_uncomputation_partial(circuit_graph: CircuitGraph, ancillas:List[str], return_uncomputed_ancillas=False, 
+                                graph_nodes_reverse:List[int]=None, reachability_index:ReachabilityIndex=None, materialize=True):
+    '''
+    Every ancilla gets uncomp nodes for its last cut comp nodes, and the cuts with 
+    the most uncomp nodes and no cycle are found exactly. Ancillas are assigned one 
+    at a time, with cuts from the whole wire down. A branch is dropped when it can 
+    not beat the best cuts so far, or when it is cyclic and no ancilla left to assign 
+    controls a gate of an assigned one from a node on that cycle, so nothing can 
+    break it. The best cuts start from greedy full uncomp, and every ancilla's cut is 
+    capped where its own nodes have such a cycle. Cycle checks use a ReachabilityIndex. Uncomp graphs are built only 
+    to find the ancillas on a cycle, and for the result. 
+    return_uncomputed_ancillas also returns the fully uncomputed ancillas. Without 
+    materialize, the UncompPlan of the cuts is returned in place of the uncomp graph.
+    '''
+    ancillas = list(ancillas)
+    if graph_nodes_reverse is None:
+        graph_nodes_reverse = get_reverse_topological_order(circuit_graph)
+    if reachability_index is None:
+        reachability_index = ReachabilityIndex(circuit_graph, graph_nodes_reverse)
+    influencers = get_ancilla_influencers(circuit_graph, ancillas)
+    comp_nodes = {a: reachability_index.comp_nodes[a] for a in ancillas}
+
+    # Ancillas on the first cycle of uncomputing nodes, tried on one graph and rolled back
+    uncomp_circuit_graph = circuit_graph.clone()
+    def cycle_ancillas(nodes):
+        uncomp_circuit_graph.checkpoint()
+        for idx in sorted(nodes, key=reachability_index.order.get):
+            cycle = add_uncomputation_step(uncomp_circuit_graph, idx)
+            if len(cycle) > 0:
+                break
+        on_cycle = {uncomp_circuit_graph.get_node_data(node_index).label for edge in cycle for node_index in edge}
+        uncomp_circuit_graph.rollback()
+        return on_cycle
+
+    # An ancilla whose last cut nodes have a cycle without influencers on it can not 
+    # uncompute that many nodes, whatever the other ancillas do
+    max_cuts = {}
+    for a in ancillas:
+        max_cuts[a] = len(comp_nodes[a])
+        for cut in range(1, len(comp_nodes[a]) + 1):
+            if reachability_index.would_cycle_nodes(comp_nodes[a][:cut]) and \
+                len(influencers[a] & cycle_ancillas(comp_nodes[a][:cut])) == 0:
+                max_cuts[a] = cut - 1
+                break
+
+    # Ancillas go after their influencers where possible, so fewer cycles of the 
+    # assigned ancillas are left for the others to break
+    order = []
+    left = set(ancillas)
+    while len(left):
+        a = min(left, key=lambda a: (len(influencers[a] & left), ancillas.index(a)))
+        order.append(a)
+        left.remove(a)
+    # Most uncomp nodes the ancillas from position i on can add
+    remaining = [sum(max_cuts[a] for a in order[i:]) for i in range(len(order) + 1)]
+
+    # Ancillas left to assign that control a gate of an assigned one from a node on 
+    # the cycle, only they can break it
+    def cycle_breakers(on_cycle, i):
+        unassigned = set(order[i:])
+        return {b for a, cut in cuts.items() if cut > 0 for b in influencers[a] if b in unassigned and b in on_cycle}
+
+    # Start from the ancillas that greedy full uncomp keeps
+    _, greedy_ancillas = greedy_uncomputation_full(circuit_graph, ancillas, return_uncomputed_ancillas=True, metric='scc')
+    best_cuts = {a: len(comp_nodes[a]) if a in greedy_ancillas else 0 for a in ancillas}
+    best_total = sum(best_cuts.values())
+    if reachability_index.would_cycle_nodes(list(chain.from_iterable(comp_nodes[a][:best_cuts[a]] for a in ancillas))):
+        best_cuts = {a: 0 for a in ancillas}
+        best_total = 0
+    cuts = {}
+    # breakers is None while the assigned cuts are acyclic. Otherwise the cycle found 
+    # last stays until one of its breakers uncomputes a node, so only then it is 
+    # checked again.
+    def search(i, nodes, total, breakers):
+        nonlocal best_cuts, best_total
+        if breakers is None and total > best_total:
+            # The ancillas left uncompute nothing
+            best_cuts = {a: cuts.get(a, 0) for a in ancillas}
+            best_total = total
+            logger.info(f'Exact partial uncomp found {best_total} uncomp nodes')
+        if i == len(order):
+            return
+
+        a = order[i]
+        for cut in range(max_cuts[a], -1, -1):
+            if total + cut + remaining[i+1] <= best_total:
+                break
+            cuts[a] = cut
+            child_nodes = nodes + comp_nodes[a][:cut]
+            if cut == 0 or (breakers is not None and a not in breakers):
+                child_breakers = None if breakers is None else breakers - {a}
+            elif breakers is not None or reachability_index.would_cycle_nodes(child_nodes):
+                # Most sets are still cyclic after a breaker uncomputes nodes, so those 
+                # go straight to finding the cycle
+                on_cycle = cycle_ancillas(child_nodes)
+                child_breakers = cycle_breakers(on_cycle, i + 1) if len(on_cycle) else None
+            else:
+                child_breakers = None
+            if child_breakers is None or len(child_breakers) > 0:
+                search(i + 1, child_nodes, total + cut, child_breakers)
+        cuts.pop(a, None)
 
+    search(0, [], 0, None)
 
+    uncomp_circuit_graph = UncompPlan.from_cuts(circuit_graph, best_cuts)
+    if materialize:
+        uncomp_circuit_graph, has_cycle = uncomp_circuit_graph.materialize(circuit_graph, graph_nodes_reverse)
+        if has_cycle:
+            raise ValueError(f'Exact partial uncomp cuts {best_cuts} still cause cycles in uncomp graph')
+
+    if return_uncomputed_ancillas:
+        return uncomp_circuit_graph, [a for a in ancillas if best_cuts[a] == len(comp_nodes[a])]
+    else:
+        return uncomp_circuit_graph
+
+
+# Run several uncomp strategies on one circuit, sharing the fully uncomputed graph with 
+# cycles, the reverse topological order and the SCCs between them
+def run_uncomp_strategies(circuit_graph: CircuitGraph, ancillas:List[str], uncomp_types:List[UncompType]=None, 
+                          strategy_kwargs:Dict[UncompType, dict]=None):
+    '''
+    Returns a dict of (uncomp graph, uncomputed ancillas) and a dict of the time 
+    in seconds taken by each strategy, both keyed on UncompType. strategy_kwargs 
+    passes extra arguments to a strategy, e.g. {UncompType.GREEDY_FULL: {'metric': 'scc'}}. 
+    REGULAR uncomputes all ancillas, cycles or not.
+    '''
+    if uncomp_types is None:
+        uncomp_types = list(UncompType)
+    if strategy_kwargs is None:
+        strategy_kwargs = {}
+    ancillas = list(ancillas)
+
+    start_time = time.time()
+    graph_nodes_reverse = get_reverse_topological_order(circuit_graph)
+    full_uncomp_graph, has_cycle = add_uncomputation(circuit_graph, ancillas, allow_cycle=True, 
+                                                     graph_nodes_reverse=graph_nodes_reverse)
+    logger.info(f'Building the shared uncomp graph took {time.time() - start_time} s')
+
+    results = {}
+    timings = {}
+    for uncomp_type in uncomp_types:
+        kwargs = strategy_kwargs.get(uncomp_type, {})
+        start_time = time.time()
+        if uncomp_type is UncompType.REGULAR:
+            results[uncomp_type] = full_uncomp_graph.clone(), ancillas
+        elif uncomp_type is UncompType.EXHAUSTIVE:
+            results[uncomp_type] = exhaustive_uncomputation(circuit_graph, ancillas, return_uncomputed_ancillas=True, 
+                                                            graph_nodes_reverse=graph_nodes_reverse, 
+                                                            full_uncomp_graph=full_uncomp_graph, **kwargs)
+        elif uncomp_type is UncompType.GREEDY_FULL:
+            results[uncomp_type] = greedy_uncomputation_full(circuit_graph, ancillas, return_uncomputed_ancillas=True, 
+                                                             full_uncomp_graph=full_uncomp_graph, **kwargs)
+        elif uncomp_type is UncompType.GREEDY_PARTIAL:
+            results[uncomp_type] = greedy_uncomputation_partial(circuit_graph, ancillas, return_uncomputed_ancillas=True, 
+                                                                full_uncomp_graph=full_uncomp_graph, **kwargs)
+        elif uncomp_type is UncompType.MILP:
+            results[uncomp_type] = milp_uncomputation(circuit_graph, ancillas, return_uncomputed_ancillas=True, 
+                                                      graph_nodes_reverse=graph_nodes_reverse, 
+                                                      full_uncomp_graph=full_uncomp_graph, **kwargs)
+        elif uncomp_type is UncompType.BEAM:
+            results[uncomp_type] = beam_uncomputation(circuit_graph, ancillas, return_uncomputed_ancillas=True, 
+                                                      full_uncomp_graph=full_uncomp_graph, **kwargs)
+        else:
+            raise ValueError(f'Unknown uncomp type {uncomp_type}')
+        timings[uncomp_type] = time.time() - start_time
+        logger.info(f'{uncomp_type.value} uncomp took {timings[uncomp_type]} s')
+
+    return results, timings
+
+
+# Split the ancillas into clusters whose uncomputations can not share a cycle, 
+# so each cluster can be solved on its own
+def get_ancilla_clusters(circuit_graph: CircuitGraph, ancillas:List[str]):
+    '''
+    The uncomp nodes of an ancilla have edges out to the TARGET successors of the 
+    controls of its gates, and in from its own comp nodes, those controls and the 
+    gates it controls. A cycle through the uncomp nodes of several ancillas so needs 
+    a path in the computation graph from each ancilla to the next, or ctrl* between 
+    them. The clusters are the strongly connected components of these relations, 
+    in the order of their first ancilla.
+    '''
+    ancillas = list(ancillas)
+    # Reachability in the computation graph, as one bitset over node indices per node
+    reach = {}
+    for idx in get_reverse_topological_order(circuit_graph):
+        reach[idx] = 1 << idx
+        for successor_idx in circuit_graph.successor_indices(idx):
+            reach[idx] |= reach[successor_idx]
+
+    out_reach = {a: 0 for a in ancillas}
+    in_mask = {a: 0 for a in ancillas}
+    for idx in circuit_graph.node_indices():
+        node = circuit_graph.get_node_data(idx)
+        if node.label not in out_reach or node.node_type is not COMP:
+            continue
+        in_mask[node.label] |= 1 << idx
+        for control_idx in circuit_graph.controls_of(idx):
+            in_mask[node.label] |= 1 << control_idx
+            for target_idx in circuit_graph.successors_by_type(control_idx, TARGET):
+                out_reach[node.label] |= reach[target_idx]
+        for controlled_idx in circuit_graph.controlled_by(idx):
+            in_mask[node.label] |= 1 << controlled_idx
+
+    relation_graph = rustworkx.PyDiGraph()
+    node_of = {a: relation_graph.add_node(a) for a in ancillas}
+    for a, b in combinations(ancillas, 2):
+        if out_reach[a] & in_mask[b]:
+            relation_graph.add_edge(node_of[a], node_of[b], None)
+        if out_reach[b] & in_mask[a]:
+            relation_graph.add_edge(node_of[b], node_of[a], None)
+    for a, influencer_set in get_ancilla_influencers(circuit_graph, ancillas).items():
+        for b in influencer_set:
+            relation_graph.add_edge(node_of[a], node_of[b], None)
+            relation_graph.add_edge(node_of[b], node_of[a], None)
+
+    clusters = [sorted((relation_graph[i] for i in component), key=ancillas.index) 
+                for component in rustworkx.strongly_connected_components(relation_graph)]
+    clusters.sort(key=lambda cluster: ancillas.index(cluster[0]))
+    logger.info(f'Split {len(ancillas)} ancillas into {len(clusters)} clusters, the largest of {max(map(len, clusters), default=0)}')
+    return clusters
+
+# Set once in every worker process of factorized_uncomputation
+_worker_circuit_graph = None
+_worker_uncomp_type = None
+_worker_strategy_kwargs = None
+
+def _init_cluster_worker(circuit_graph: CircuitGraph, uncomp_type: UncompType, strategy_kwargs:dict):
+    global _worker_circuit_graph, _worker_uncomp_type, _worker_strategy_kwargs
+    _worker_circuit_graph = circuit_graph
+    _worker_uncomp_type = uncomp_type
+    _worker_strategy_kwargs = strategy_kwargs
+
+def _solve_cluster(cluster:List[str]):
+    '''
+    Run the worker's uncomp strategy on one cluster. Returns its uncomp graph and 
+    uncomputed ancillas.
+    '''
+    strategies = {
+        UncompType.EXHAUSTIVE: exhaustive_uncomputation,
+        UncompType.GREEDY_FULL: greedy_uncomputation_full,
+        UncompType.GREEDY_PARTIAL: greedy_uncomputation_partial,
+        UncompType.MILP: milp_uncomputation,
+        UncompType.BEAM: beam_uncomputation,
+    }
+    if _worker_uncomp_type not in strategies:
+        raise ValueError(f'Uncomp type {_worker_uncomp_type} can not be factorized')
+    result = strategies[_worker_uncomp_type](_worker_circuit_graph, cluster, return_uncomputed_ancillas=True, 
+                                             **_worker_strategy_kwargs)
+    return result[0], list(result[1])
+
+def merge_uncomp_graphs(circuit_graph: CircuitGraph, uncomp_graphs:List[CircuitGraph]):
+    '''
+    Union of uncomp graphs built from circuit_graph for disjoint sets of ancillas: 
+    their new nodes, new edges and node flags are copied onto one clone of circuit_graph.
+    '''
+    merged_graph = circuit_graph.clone()
+    for uncomp_graph in uncomp_graphs:
+        new_index = {}
+        for idx in uncomp_graph.node_indices():
+            if not circuit_graph.has_node(idx):
+                new_index[idx] = merged_graph.add_node(uncomp_graph.get_node_data(idx).clone())
+                merged_graph.get_node_data(new_index[idx]).set_index(new_index[idx])
+        
+        for parent, child, edge in uncomp_graph.weighted_edge_list():
+            if parent in new_index or child in new_index or not circuit_graph.has_edge(parent, child):
+                merged_graph.add_edge(new_index.get(parent, parent), new_index.get(child, child), edge)
+        
+        for idx in circuit_graph.node_indices():
+            node = uncomp_graph.get_node_data(idx)
+            if node.is_uncomputed or node.mark:
+                merged_graph.set_node_flags(idx, is_uncomputed=node.is_uncomputed, mark=node.mark, 
+                                            uncomp_node_index=new_index.get(node.uncomp_node_index, node.uncomp_node_index))
+    return merged_graph
+
+def factorized_uncomputation(circuit_graph: CircuitGraph, ancillas:List[str], uncomp_type: UncompType=UncompType.EXHAUSTIVE, 
+                             max_workers=None, return_uncomputed_ancillas=False, clusters:List[List[str]]=None, **strategy_kwargs):
+    '''
+    Solve the uncomp of each ancilla cluster, see get_ancilla_clusters, on its own 
+    and merge the uncomputed nodes. Clusters run over a process pool unless 
+    max_workers is 1. Exhaustive stays optimal and costs the sum of 2^(cluster size) 
+    instead of 2^n. strategy_kwargs are passed to the strategy of uncomp_type, 
+    without a time_budget.
+    '''
+    ancillas = list(ancillas)
+    if clusters is None:
+        clusters = get_ancilla_clusters(circuit_graph, ancillas)
+
+    if max_workers == 1 or len(clusters) <= 1:
+        _init_cluster_worker(circuit_graph, uncomp_type, strategy_kwargs)
+        solutions = [_solve_cluster(cluster) for cluster in tqdm(clusters, desc='Solving Ancilla Clusters')]
+    else:
+        # Largest clusters first, they take the longest
+        order = sorted(range(len(clusters)), key=lambda i: -len(clusters[i]))
+        solutions = [None] * len(clusters)
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_cluster_worker, 
+                                 initargs=(circuit_graph, uncomp_type, strategy_kwargs)) as executor:
+            futures = {executor.submit(_solve_cluster, clusters[i]): i for i in order}
+            for future in tqdm(as_completed(futures), total=len(futures), desc='Solving Ancilla Clusters'):
+                solutions[futures[future]] = future.result()
+
+    uncomputed_ancillas = [a for a in ancillas if any(a in solution[1] for solution in solutions)]
+    # The clusters do not change each others edges, so the union of their graphs is 
+    # the graph of uncomputing all of them
+    if len(solutions) == 1:
+        uncomp_circuit_graph = solutions[0][0]
+    else:
+        uncomp_circuit_graph = merge_uncomp_graphs(circuit_graph, [solution[0] for solution in solutions])
+    if len(uncomp_circuit_graph.find_cycle()) > 0:
+        raise ValueError(f'Merged uncomp of the clusters {clusters} has a cycle')
+
+    if return_uncomputed_ancillas:
+        return uncomp_circuit_graph, uncomputed_ancillas
+    else:
+        return uncomp_circuit_graph